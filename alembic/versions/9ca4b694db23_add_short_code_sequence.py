@@ -0,0 +1,28 @@
+"""add short code sequence
+
+Revision ID: 9ca4b694db23
+Revises: 096d18f2be18
+Create Date: 2026-10-17 04:18:55.336966
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9ca4b694db23'
+down_revision: Union[str, None] = '096d18f2be18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # INCREMENT BY is the block size reserved by each worker, it must match
+    # SHORT_CODE_BLOCK_SIZE in api/v1/models/short_urls.py
+    op.execute(sa.schema.CreateSequence(sa.Sequence('short_code_seq', start=1, increment=1000)))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('short_code_seq')))
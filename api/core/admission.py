@@ -0,0 +1,257 @@
+"""Admission control, shedding load before requests pile up on the database"""
+
+import asyncio
+import os
+from collections import deque
+
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api.core import response_messages
+from api.core.config import settings
+
+# Operational endpoints stay reachable however loaded the server is, along
+# with every path under EXEMPT_PREFIXES
+EXEMPT_PATHS = {
+    "/",
+    "/probe",
+    "/metrics",
+    "/docs",
+    "/docs/oauth2-redirect",
+    "/redoc",
+    "/openapi.json",
+    "/request-stats",
+    "/admission-stats",
+    "/cache-stats",
+    "/click-stats",
+    "/password-hash-stats",
+    "/rate-limit-stats",
+}
+EXEMPT_PREFIXES = ("/health/",)
+
+
+def route_class(path: str) -> str:
+    """Admission class of a request path, or None if it is never queued"""
+    if path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES):
+        return None
+
+    if path.startswith("/api/"):
+        return "api"
+
+    return "redirect"
+
+
+class RequestClass:
+    """Limits and counters of one class of requests, classes with a lower
+    `priority` value are served first"""
+
+    __slots__ = ("name", "priority", "max_in_flight", "in_flight", "waiters", "admitted", "shed")
+
+    def __init__(self, name: str, priority: int, max_in_flight: int):
+        self.name = name
+        self.priority = priority
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+
+
+class AdmissionController:
+    """Caps the number of requests in flight, per class and overall
+
+    Requests over a cap wait in a bounded queue. When a request finishes
+    its slot goes to the oldest waiter of the highest priority class that
+    is under its own cap, so redirects get through before management
+    requests. A request is shed with a 503 when the queue is full or when
+    it has waited `queue_timeout` seconds, which is cheaper for everyone
+    than letting it time out on an exhausted connection pool.
+
+    It is only used from the event loop, so it needs no locking.
+
+    Args:
+        max_in_flight (int): requests in flight across all classes
+        classes (list[RequestClass]): request classes
+        max_queue (int): requests waiting across all classes
+        queue_timeout (float): seconds a request may wait for a slot
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        classes: list[RequestClass],
+        max_queue: int = 500,
+        queue_timeout: float = 0.5,
+    ):
+        self.max_in_flight = max_in_flight
+        self.classes = {request_class.name: request_class for request_class in classes}
+        self.by_priority = sorted(classes, key=lambda request_class: request_class.priority)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+
+    def _can_admit(self, request_class: RequestClass) -> bool:
+        return (
+            self.in_flight < self.max_in_flight
+            and request_class.in_flight < request_class.max_in_flight
+        )
+
+    def _admit(self, request_class: RequestClass):
+        self.in_flight += 1
+        request_class.in_flight += 1
+        request_class.admitted += 1
+
+    def _has_priority_waiters(self, request_class: RequestClass) -> bool:
+        return any(
+            other.waiters
+            for other in self.by_priority
+            if other.priority <= request_class.priority
+        )
+
+    async def acquire(self, name: str) -> bool:
+        """Wait for a slot in class `name`, False if the request is shed"""
+        request_class = self.classes[name]
+
+        # waiters of the same or a higher priority go first
+        if self._can_admit(request_class) and not self._has_priority_waiters(request_class):
+            self._admit(request_class)
+            return True
+
+        if self.queued >= self.max_queue:
+            request_class.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        request_class.waiters.append(waiter)
+        self.queued += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # the slot was handed over just as the wait ended
+                if isinstance(e, asyncio.CancelledError):
+                    self.release(name)
+                    raise
+                return True
+
+            waiter.cancel()
+            request_class.waiters.remove(waiter)
+            self.queued -= 1
+
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+            request_class.shed += 1
+            return False
+
+    def release(self, name: str):
+        """Free the slot of a finished request and hand it to a waiter"""
+        request_class = self.classes[name]
+        self.in_flight -= 1
+        request_class.in_flight -= 1
+
+        for candidate in self.by_priority:
+            while candidate.waiters and self._can_admit(candidate):
+                waiter = candidate.waiters.popleft()
+                self.queued -= 1
+                self._admit(candidate)
+                waiter.set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "classes": {
+                request_class.name: {
+                    "priority": request_class.priority,
+                    "in_flight": request_class.in_flight,
+                    "max_in_flight": request_class.max_in_flight,
+                    "queued": len(request_class.waiters),
+                    "admitted": request_class.admitted,
+                    "shed": request_class.shed,
+                }
+                for request_class in self.by_priority
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Render this worker's gauges in the Prometheus text format"""
+        worker = os.getpid()
+        lines = [
+            "# HELP admission_in_flight Requests being served",
+            "# TYPE admission_in_flight gauge",
+        ]
+        lines += [
+            f'admission_in_flight{{worker="{worker}",class="{c.name}"}} {c.in_flight}'
+            for c in self.by_priority
+        ]
+        lines += [
+            "# HELP admission_queue_depth Requests waiting for a slot",
+            "# TYPE admission_queue_depth gauge",
+        ]
+        lines += [
+            f'admission_queue_depth{{worker="{worker}",class="{c.name}"}} {len(c.waiters)}'
+            for c in self.by_priority
+        ]
+        lines += [
+            "# HELP admission_shed_total Requests rejected by admission control",
+            "# TYPE admission_shed_total counter",
+        ]
+        lines += [
+            f'admission_shed_total{{worker="{worker}",class="{c.name}"}} {c.shed}'
+            for c in self.by_priority
+        ]
+
+        return "\n".join(lines) + "\n"
+
+
+class AdmissionControlMiddleware:
+    """Pure ASGI middleware running every request through an
+    `AdmissionController`, answering shed requests with a 503"""
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings.ADMISSION_CONTROL_ENABLED:
+            return await self.app(scope, receive, send)
+
+        name = route_class(scope["path"])
+
+        if name is None:
+            return await self.app(scope, receive, send)
+
+        if not await self.controller.acquire(name):
+            response = JSONResponse(
+                status_code=503,
+                content={
+                    "status": False,
+                    "status_code": 503,
+                    "message": response_messages.SERVER_OVERLOADED,
+                },
+                headers={"Retry-After": "1"},
+            )
+            return await response(scope, receive, send)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name)
+
+
+admission_controller = AdmissionController(
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    classes=[
+        RequestClass("redirect", 0, settings.ADMISSION_REDIRECT_MAX_IN_FLIGHT),
+        RequestClass("api", 1, settings.ADMISSION_API_MAX_IN_FLIGHT),
+    ],
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+)
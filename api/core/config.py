@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pydantic_settings import BaseSettings
 from pathlib import Path
 
@@ -23,6 +24,173 @@ class Settings(BaseSettings):
     DATABASE_PASSWORD: str
     DATABASE_NAME: str
     DATABASE_TYPE: str
+    ASYNC_DATABASE_DRIVER: str = "asyncpg"
+
+    # Connection pool of each engine, per worker. DB_POOL_WARMUP
+    # connections are opened at startup, before traffic is accepted.
+    # Each worker has a sync and an async engine per database, so a host
+    # opens up to workers * 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    # connections to the primary, and as many to each replica and shard:
+    # 4 * 2 * (5 + 5) = 80 by default, under Postgres' default
+    # max_connections of 100 with room for alembic and the tools. Divide
+    # max_connections between every host sharing a database.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 5
+    DB_POOL_TIMEOUT: float = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_WARMUP: int = 0
+
+    # Read replicas, as a JSON list of database urls. Reads go round-robin
+    # to the healthy ones, and to the primary for READ_YOUR_WRITES_WINDOW
+    # seconds after a user's own write.
+    DATABASE_REPLICA_URLS: list[str] = []
+    REPLICA_HEALTH_CHECK_INTERVAL: float = 5
+    READ_YOUR_WRITES_WINDOW: float = 5
+    # users who recently wrote, shared by the workers in the backend chosen
+    # by REDIRECT_L2_CACHE. With "none", or "sqlite" and several hosts, a
+    # user's request served elsewhere may not see their write yet.
+    RECENT_WRITERS_PATH: str = os.path.join(
+        tempfile.gettempdir(), "kekere-cache", "recent-writers.sqlite3"
+    )
+
+    # Databases the short_urls table is sharded across, as a JSON list of
+    # urls, by consistent hashing of the short code. Only append to it,
+    # then run `python -m api.db.rebalance`. Alembic only migrates the
+    # primary, run `python -m api.db.rebalance --migrate` after it to
+    # update the shards. Empty keeps short urls on the primary. Read
+    # replicas are not used once this is set.
+    SHORT_URL_SHARD_URLS: list[str] = []
+
+    # Key of the bijective scramble applied to generated short codes, so
+    # they are not guessable. Required outside dev, where an empty key
+    # falls back to one derived from SECRET_KEY. Changing it once codes
+    # have been issued makes new codes collide with old ones. Set
+    # SHORT_CODE_SEQUENTIAL to issue sequential, enumerable codes instead.
+    SHORT_CODE_SCRAMBLE_KEY: str = ""
+    SHORT_CODE_SEQUENTIAL: bool = False
+
+    # Password hashing executor, "thread" or "process"
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 256
+
+    # Authenticated user cache. Changed users are dropped from every worker
+    # through an invalidation log in the backend chosen by
+    # REDIRECT_L2_CACHE, within CACHE_INVALIDATION_POLL_INTERVAL. With
+    # "none", other workers keep them for up to USER_CACHE_TTL seconds.
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 60
+    USER_CACHE_INVALIDATION_LOG_PATH: str = os.path.join(
+        tempfile.gettempdir(), "kekere-cache", "users.sqlite3"
+    )
+
+    # Bulk short url creation
+    BULK_SHORTEN_MAX_ITEMS: int = 50000
+    BULK_SHORTEN_BATCH_SIZE: int = 1000
+
+    # Redirect cache
+    REDIRECT_CACHE_SIZE: int = 10000
+    REDIRECT_CACHE_TTL: int = 300
+
+    # Token bucket rate limits, as "<requests>/<second|minute|hour|day>".
+    # Each worker enforces them on its own, so a client gets up to
+    # workers * limit across the server.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    RATE_LIMIT_REDIRECT: str = "300/minute"
+    RATE_LIMIT_AUTH: str = "10/minute"
+    RATE_LIMIT_SHORTEN: str = "60/minute"
+    RATE_LIMIT_BULK_SHORTEN: str = "10/minute"
+    # Addresses or networks of the CDN, load balancers and proxies in front
+    # of the app, as a JSON list. Requests from them are counted by the
+    # client address they forward in X-Forwarded-For. Behind any proxy left
+    # out, every client shares that proxy's limit.
+    RATE_LIMIT_TRUSTED_PROXIES: list[str] = []
+
+    # Admission control, per worker. Requests over the in-flight caps wait
+    # up to ADMISSION_QUEUE_TIMEOUT seconds for a slot before a 503.
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_MAX_IN_FLIGHT: int = 200
+    ADMISSION_REDIRECT_MAX_IN_FLIGHT: int = 200
+    ADMISSION_API_MAX_IN_FLIGHT: int = 40
+    ADMISSION_MAX_QUEUE: int = 1000
+    ADMISSION_QUEUE_TIMEOUT: float = 0.5
+
+    # Bloom filter of existing short codes, takes about
+    # -capacity * ln(error_rate) / ln(2) ** 2 bits
+    BLOOM_FILTER_ENABLED: bool = True
+    BLOOM_FILTER_CAPACITY: int = 1000000
+    BLOOM_FILTER_ERROR_RATE: float = 0.01
+    BLOOM_FILTER_SYNC_INTERVAL: float = 2
+    BLOOM_FILTER_REBUILD_INTERVAL: float = 3600
+    # lookups missing the filter read the log of new codes at most once per
+    # this many seconds, sharing each read
+    BLOOM_FILTER_LOG_READ_INTERVAL: float = 0.05
+    # log of new short codes shared by the workers, in the backend chosen
+    # by REDIRECT_L2_CACHE
+    BLOOM_FILTER_LOG_PATH: str = os.path.join(
+        tempfile.gettempdir(), "kekere-cache", "short-codes.sqlite3"
+    )
+
+    # Seconds browsers and CDNs may cache redirects of links without their
+    # own cache_max_age, 0 to forbid it
+    REDIRECT_DEFAULT_CACHE_MAX_AGE: int = 300
+    # Endpoint POSTed {"paths": [...]} when links change, to purge the CDN
+    CDN_PURGE_WEBHOOK_URL: str = ""
+    # Changed links are purged again after this many seconds, once no
+    # worker serves the old target. Keep it over
+    # CACHE_INVALIDATION_POLL_INTERVAL, and with redirect-only hosts that
+    # don't share the invalidation log, over the delta export interval plus
+    # REDIRECT_SNAPSHOT_REFRESH_INTERVAL.
+    CDN_PURGE_DELAY: float = 10
+    # Attempts at a purge before giving up on it, retried with backoff
+    CDN_PURGE_ATTEMPTS: int = 5
+
+    # Cache shared by the workers behind each one's redirect cache, "none",
+    # "memory" (single process) or "sqlite" (workers of one host). Changed
+    # links are dropped from every worker within the poll interval. Both
+    # backends are host-local: with several hosts, a changed link is only
+    # dropped on the host that changed it, the others serve it until it
+    # expires, up to REDIRECT_L2_CACHE_TTL seconds.
+    REDIRECT_L2_CACHE: str = "sqlite"
+    REDIRECT_L2_CACHE_PATH: str = os.path.join(
+        tempfile.gettempdir(), "kekere-cache", "redirects.sqlite3"
+    )
+    REDIRECT_L2_CACHE_TTL: int = 3600
+    CACHE_INVALIDATION_POLL_INTERVAL: float = 1
+
+    # Redirect-only mode serves just the redirect and operational endpoints,
+    # resolving short codes from a snapshot exported by
+    # `python -m api.db.export_snapshot`, and the database on a miss
+    REDIRECT_ONLY_MODE: bool = False
+    REDIRECT_SNAPSHOT_PATH: str = os.path.join(
+        tempfile.gettempdir(), "kekere-snapshot", "redirects.snap"
+    )
+    REDIRECT_SNAPSHOT_REFRESH_INTERVAL: float = 5
+
+    # Write-behind click counter
+    CLICK_FLUSH_INTERVAL: float = 5
+    CLICK_FLUSH_MAX_BATCH_SIZE: int = 1000
+    # longest wait between two flushes while the database fails
+    CLICK_FLUSH_MAX_BACKOFF: float = 60
+
+    # Click event pipeline
+    CLICK_EVENTS_QUEUE_SIZE: int = 100000
+    CLICK_EVENTS_BATCH_SIZE: int = 1000
+    CLICK_EVENTS_FLUSH_INTERVAL: float = 1
+
+    # Precision of the unique visitor HyperLogLog sketches, each one takes
+    # 2 ** HLL_PRECISION bytes. Must not change once sketches are stored.
+    HLL_PRECISION: int = 12
+
+    # Trending links, tracked per worker with a decaying top-k summary
+    TRENDING_CAPACITY: int = 1000
+    TRENDING_HALF_LIFE: float = 3600
+
+    # Directory the workers share their request metrics through
+    METRICS_DIR: str = os.path.join(tempfile.gettempdir(), "kekere-metrics")
+    METRICS_FLUSH_INTERVAL: float = 5
 
     # Directories
     MEDIA_DIR: str = os.path.join(BASE_DIR, "media")
@@ -39,6 +207,12 @@ class Settings(BaseSettings):
         """Dynamically construct DATABASE_URL"""
         return f"{self.DATABASE_TYPE}://{self.DATABASE_USER}:{self.DATABASE_PASSWORD}@{self.DATABASE_HOST}:{self.DATABASE_PORT}/{self.DATABASE_NAME}"
 
+    @property
+    def async_database_url(self) -> str:
+        """DATABASE_URL with the dialect's driver swapped for an asyncio one"""
+        dialect = self.DATABASE_TYPE.split("+")[0]
+        return f"{dialect}+{self.ASYNC_DATABASE_DRIVER}://{self.DATABASE_USER}:{self.DATABASE_PASSWORD}@{self.DATABASE_HOST}:{self.DATABASE_PORT}/{self.DATABASE_NAME}"
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,110 @@
+import ipaddress
+import math
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request, status
+
+from api.core import response_messages
+from api.core.config import settings
+from api.core.dependencies.security import get_current_user
+from api.utils.rate_limiter import TokenBucketLimiter, parse_rate
+from api.v1.models.user import User
+
+# every RateLimit dependency, by name, for the stats endpoint
+rate_limits = {}
+
+trusted_proxies = [
+    ipaddress.ip_network(proxy, strict=False)
+    for proxy in settings.RATE_LIMIT_TRUSTED_PROXIES
+]
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_ip(request: Request):
+    """Address of the client that sent `request`. Through trusted proxies
+    it is the last X-Forwarded-For address not added by one of them, as
+    earlier ones can be forged by the client."""
+    if request.client is None:
+        return None
+
+    address = request.client.host
+
+    if not trusted_proxies or not _is_trusted(address):
+        return address
+
+    forwarded = request.headers.get("x-forwarded-for", "")
+
+    for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+        address = hop
+        if not _is_trusted(hop):
+            break
+
+    return address
+
+
+class RateLimit:
+    """Dependency limiting how often a route can be called
+
+    Requests are counted per client IP (`key="ip"`, see `client_ip`) or for
+    the route as a whole (`key="route"`), and rejected with a 429 carrying `Retry-After`
+    once the limit is reached. Limits apply per worker process.
+
+    Args:
+        name (str): name the limiter is reported under
+        limit (str): allowed rate, such as "30/minute"
+        key (str, optional): "ip" or "route". Defaults to "ip".
+    """
+
+    def __init__(self, name: str, limit: str, key: str = "ip"):
+        count, period = parse_rate(limit)
+
+        self.name = name
+        self.key = key
+        self.limiter = TokenBucketLimiter(
+            rate=count / period, burst=count, maxsize=settings.RATE_LIMIT_MAX_KEYS
+        )
+        rate_limits[name] = self
+
+    def check(self, key):
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        retry_after = self.limiter.acquire(key)
+
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=response_messages.TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    async def __call__(self, request: Request):
+        # async, so the check runs on the event loop instead of the threadpool
+        if self.key == "route":
+            self.check(self.name)
+        else:
+            self.check(client_ip(request))
+
+
+class UserRateLimit(RateLimit):
+    """`RateLimit` counting requests per authenticated user"""
+
+    def __init__(self, name: str, limit: str):
+        super().__init__(name, limit, key="user")
+
+    async def __call__(self, current_user: Annotated[User, Depends(get_current_user)]):
+        self.check(current_user.id)
+
+
+redirect_rate_limit = RateLimit("redirect", settings.RATE_LIMIT_REDIRECT)
+auth_rate_limit = RateLimit("auth", settings.RATE_LIMIT_AUTH)
+shorten_rate_limit = UserRateLimit("shorten", settings.RATE_LIMIT_SHORTEN)
+bulk_shorten_rate_limit = UserRateLimit("bulk_shorten", settings.RATE_LIMIT_BULK_SHORTEN)
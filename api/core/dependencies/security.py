@@ -1,16 +1,71 @@
+import time
+
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from jose import jwt
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from typing import Annotated
 
 from api.v1.models.user import User
-from api.db.database import get_db
+from api.db.database import get_db, replicas
+from api.db.replicas import is_recent_writer, use_primary
+from api.utils.cache import LRUCache, SharedInvalidations
+from api.utils.shared_cache import create_shared_cache
 from api.utils.jwt_helpers import verify_jwt_token
 from api.core import response_messages
+from api.core.config import settings
 
 
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# Session.info key of the ids of the users changed in its transaction
+CHANGED_USERS = "changed_users"
+
+# verified access token -> detached User snapshot
+user_cache = LRUCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+def _drop_user(user_id: str):
+    user_cache.delete_where(lambda user: user.id == user_id)
+
+
+# drops changed users from the user cache of every worker
+user_invalidations = SharedInvalidations(
+    create_shared_cache(
+        settings.REDIRECT_L2_CACHE, settings.USER_CACHE_INVALIDATION_LOG_PATH
+    ),
+    on_invalidate=_drop_user,
+    poll_interval=settings.CACHE_INVALIDATION_POLL_INTERVAL,
+)
+
+
+def invalidate_user(user_id: str):
+    """Drop every cached token of a user in every worker, so the next
+    request made with any of them reloads the user from the database"""
+    user_invalidations.publish([user_id])
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    session = object_session(target)
+
+    if session is None:
+        invalidate_user(target.id)
+        return
+
+    # published once committed, so no worker reloads the old row
+    session.info.setdefault(CHANGED_USERS, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changed_users(session):
+    changed = session.info.pop(CHANGED_USERS, None)
+
+    if changed:
+        user_invalidations.publish(list(changed))
+
 
 def get_current_user(
     db: Annotated[Session, Depends(get_db)],
@@ -20,6 +75,10 @@ def get_current_user(
     Useful for protecting routes and restricting their access to only
     authenticated users
 
+    Verified tokens are cached for `USER_CACHE_TTL` seconds (never past the
+    token's own expiry), so repeated calls with the same token skip both
+    the signature check and the user query.
+
     Args:
         db (Annotated[Session, Depends): Database Session
         access_token (Annotated[str, Depends): JWT access token
@@ -28,6 +87,13 @@ def get_current_user(
         User: Logged in User object
     """
 
+    user = user_cache.get(access_token)
+
+    if user is not None:
+        if is_recent_writer(user.id):
+            use_primary(db)
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail=response_messages.INVALID_CREDENTIALS,
@@ -40,7 +106,27 @@ def get_current_user(
 
     user = db.query(User).filter(User.id == user_id).first()
 
+    if not user and replicas.replicas:
+        # a user who just registered may not have reached the replica yet
+        use_primary(db)
+        user = db.query(User).filter(User.id == user_id).first()
+
     if not user:
         raise credentials_exception
 
+    if is_recent_writer(user.id):
+        use_primary(db)
+
+    # Detach the user so commits made later in this request don't expire
+    # the attributes of the cached snapshot
+    db.expunge(user)
+
+    ttl = settings.USER_CACHE_TTL
+    expiry = jwt.get_unverified_claims(access_token).get("exp")
+
+    if expiry is not None:
+        ttl = min(ttl, expiry - time.time())
+
+    user_cache.set(access_token, user, ttl=ttl)
+
     return user
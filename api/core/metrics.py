@@ -0,0 +1,338 @@
+"""Request metrics collected by a pure ASGI middleware"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.core.config import settings
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+# Route label for requests that did not match any route
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RouteStats:
+    """Counters and latency histogram of a single (method, route) pair"""
+
+    __slots__ = ("count", "latency_sum", "bucket_counts", "status_counts")
+
+    def __init__(self, buckets: int):
+        self.count = 0
+        self.latency_sum = 0.0
+        # one slot per bucket, plus the +Inf one
+        self.bucket_counts = [0] * (buckets + 1)
+        self.status_counts = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "latency_sum": self.latency_sum,
+            "bucket_counts": list(self.bucket_counts),
+            "status_counts": {str(code): n for code, n in self.status_counts.items()},
+        }
+
+    def merge(self, data: dict):
+        """Add the counters of a `to_dict` snapshot to these"""
+        self.count += data["count"]
+        self.latency_sum += data["latency_sum"]
+        self.bucket_counts = [
+            mine + theirs for mine, theirs in zip(self.bucket_counts, data["bucket_counts"])
+        ]
+        for code, n in data["status_counts"].items():
+            self.status_counts[int(code)] = self.status_counts.get(int(code), 0) + n
+
+
+class RequestMetrics:
+    """Fixed-size request metrics, grouped by route template
+
+    Requests are keyed by their method and route template (`/{short_code}`
+    rather than every concrete short code), so memory use is bounded by the
+    number of routes, not the number of distinct urls or clients.
+
+    Args:
+        buckets (tuple, optional): latency histogram upper bounds in seconds
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.routes = {}
+
+    def observe(self, method: str, route: str, status_code: int, latency: float):
+        """Record one request"""
+        if method not in HTTP_METHODS:
+            method = "OTHER"
+
+        stats = self.routes.get((method, route))
+
+        if stats is None:
+            stats = self.routes[(method, route)] = RouteStats(len(self.buckets))
+
+        stats.count += 1
+        stats.latency_sum += latency
+        stats.status_counts[status_code] = stats.status_counts.get(status_code, 0) + 1
+
+        for index, bound in enumerate(self.buckets):
+            if latency <= bound:
+                break
+        else:
+            index = len(self.buckets)
+
+        stats.bucket_counts[index] += 1
+
+    def snapshot(self) -> list:
+        """JSON serializable copy of all the counters"""
+        return [
+            {"method": method, "route": route, **stats.to_dict()}
+            for (method, route), stats in list(self.routes.items())
+        ]
+
+    def merge(self, snapshot: list):
+        """Add the counters of another process' `snapshot` to these"""
+        for entry in snapshot:
+            key = (entry["method"], entry["route"])
+            stats = self.routes.get(key)
+
+            if stats is None:
+                stats = self.routes[key] = RouteStats(len(self.buckets))
+
+            stats.merge(entry)
+
+    def quantile(self, stats: RouteStats, q: float) -> float:
+        """Estimate a latency quantile from the histogram, as the upper bound
+        of the bucket it falls in"""
+        rank = q * stats.count
+        seen = 0
+
+        for bound, count in zip(self.buckets, stats.bucket_counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return float("inf")
+
+    def summary(self) -> dict:
+        """JSON friendly summary, per route then per method"""
+        summary = {}
+
+        for (method, route), stats in sorted(self.routes.items()):
+            summary.setdefault(route, {})[method] = {
+                "count": stats.count,
+                "status_codes": {
+                    str(code): count for code, count in sorted(stats.status_counts.items())
+                },
+                "latency_seconds": {
+                    "avg": stats.latency_sum / stats.count,
+                    "p50": self.quantile(stats, 0.5),
+                    "p95": self.quantile(stats, 0.95),
+                    "p99": self.quantile(stats, 0.99),
+                },
+            }
+
+        return summary
+
+    def prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP http_requests_total Total number of HTTP requests",
+            "# TYPE http_requests_total counter",
+        ]
+
+        for (method, route), stats in sorted(self.routes.items()):
+            for code, count in sorted(stats.status_counts.items()):
+                lines.append(
+                    f'http_requests_total{{method="{method}",route="{route}",status="{code}"}} {count}'
+                )
+
+        lines += [
+            "# HELP http_request_duration_seconds HTTP request latency",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+
+        for (method, route), stats in sorted(self.routes.items()):
+            labels = f'method="{method}",route="{route}"'
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, stats.bucket_counts):
+                cumulative += count
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+
+            lines += [
+                f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}',
+                f"http_request_duration_seconds_sum{{{labels}}} {stats.latency_sum}",
+                f"http_request_duration_seconds_count{{{labels}}} {stats.count}",
+            ]
+
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware recording every request into `RequestMetrics`
+
+    Unlike a `BaseHTTPMiddleware`, it does not wrap the request and response
+    in extra tasks and streams, it only watches the response status.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            self.metrics.observe(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                status_code,
+                time.perf_counter() - start,
+            )
+
+
+class SharedMetricsStore:
+    """Shares request metrics between the workers of a server
+
+    Each worker periodically writes a snapshot of its own counters to
+    `<directory>/<pid>.json`. Reads write the reader's snapshot first, then
+    sum every worker's file, so any worker can answer with cluster-wide
+    numbers while the request path only ever touches local memory. Only
+    files are summed, a scrape served by another worker can't see older
+    counters than the previous one, and totals never go down.
+
+    Args:
+        directory (str): directory shared by all the workers
+        interval (float): seconds between two snapshots
+    """
+
+    def __init__(self, directory: str, interval: float = 5):
+        self.directory = directory
+        self.interval = interval
+        self._task = None
+        self._lock = threading.Lock()
+        self._written_at = None
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write(self, snapshot: list, taken_at: float):
+        """Atomically replace this worker's snapshot file, unless a snapshot
+        taken after `taken_at` already replaced it"""
+        with self._lock:
+            if self._written_at is not None and taken_at < self._written_at:
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            tmp_path = f"{path}.tmp"
+
+            with open(tmp_path, "w") as file:
+                json.dump(snapshot, file)
+
+            os.replace(tmp_path, path)
+            self._written_at = taken_at
+
+    def collect(self, snapshot: list, taken_at: float) -> RequestMetrics:
+        """Write `snapshot`, this worker's live counters taken at
+        `taken_at`, then merge the snapshot files of every worker"""
+        self.write(snapshot, taken_at)
+        merged = RequestMetrics()
+
+        for name in self._snapshot_files():
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    merged.merge(json.load(file))
+            except (OSError, ValueError):
+                # removed or being replaced by its worker, skip it this time
+                continue
+
+        return merged
+
+    def _snapshot_files(self) -> list:
+        """Names of the workers' snapshot files, `<pid>.json`. Other files
+        in the directory are left alone."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return [
+            name
+            for name in names
+            if name.endswith(".json") and name.removesuffix(".json").isdigit()
+        ]
+
+    def remove_dead_workers(self):
+        """Delete snapshots left behind by processes that no longer exist"""
+        for name in self._snapshot_files():
+            pid = int(name.removesuffix(".json"))
+
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(self._path(pid))
+                except FileNotFoundError:
+                    pass
+            except PermissionError:
+                # the process exists but belongs to another user
+                continue
+
+    async def run(self, metrics: RequestMetrics):
+        while True:
+            await asyncio.sleep(self.interval)
+            # snapshot on the event loop, only the file I/O goes to a thread
+            await asyncio.to_thread(self.write, metrics.snapshot(), time.monotonic())
+
+    def start(self, metrics: RequestMetrics):
+        """Start writing `metrics` snapshots in the background"""
+        if self._task is None:
+            self.remove_dead_workers()
+            self._task = asyncio.create_task(self.run(metrics))
+
+    async def stop(self, metrics: RequestMetrics):
+        """Stop the background task, writing one last snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await asyncio.to_thread(self.write, metrics.snapshot(), time.monotonic())
+
+
+request_metrics = RequestMetrics()
+metrics_store = SharedMetricsStore(
+    directory=settings.METRICS_DIR, interval=settings.METRICS_FLUSH_INTERVAL
+)
+
+
+async def collect_request_metrics() -> RequestMetrics:
+    """Request metrics of every worker of the server"""
+    return await asyncio.to_thread(
+        metrics_store.collect, request_metrics.snapshot(), time.monotonic()
+    )
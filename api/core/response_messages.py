@@ -3,8 +3,19 @@ EMAIL_ALREADY_EXISTS = "User with this email already exists"
 INVALID_EMAIL = "User with the email does not exist"
 INVALID_PASSWORD = "Wrong user password"
 
+TOO_MANY_AUTH_REQUESTS = "Too many authentication requests, try again shortly"
+TOO_MANY_REQUESTS = "Too many requests, try again later"
+SERVER_OVERLOADED = "Server is overloaded, try again shortly"
+
 INVALID_CREDENTIALS = "Could not validate credentials"
 EXPIRED_REFRESH_TOKEN = "Refresh token expired"
 TOKEN_REFRESH_SUCCESSFUL = "Tokens refreshed succesfully"
 
 ALIAS_IN_USE = "This custom alias is currently in use, try something else!"
+
+BULK_TOO_MANY_ITEMS = "Too many items in bulk request"
+BULK_INVALID_BODY = "Bulk request body must be a JSON array or NDJSON"
+
+INVALID_CURSOR = "Invalid pagination cursor"
+INVALID_FIELDS = "Unknown fields requested"
+INVALID_STATS_RANGE = "Invalid stats time range"
@@ -1,18 +1,230 @@
 """The database module"""
 
+import asyncio
+import threading
+import time
+
 from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from api.core.config import settings
+from api.db.replicas import ReplicaHealthMonitor, ReplicaSet, RoutingSession
+from api.db.sharding import ShardRouter, ShortUrlShardedSession
 
 DATABASE_URL = settings.database_url
+ASYNC_DATABASE_URL = settings.async_database_url
+
+
+class PoolWaitStats:
+    """How long checkouts waited for a connection, including the time to
+    open one when the pool had room for it"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_sum += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def to_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_seconds": self.wait_sum / self.checkouts if self.checkouts else 0,
+            "wait_max_seconds": self.wait_max,
+        }
+
+
+class TimedPoolMixin:
+    """Records the time every checkout spends waiting on the pool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_stats.observe(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.wait_stats.observe(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Applied to both engines, so each worker can hold up to twice
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
+
+
+def to_async_url(url: str) -> str:
+    """`url` with the dialect's driver swapped for an asyncio one"""
+    url = make_url(url)
+    dialect = url.drivername.split("+")[0]
+    url = url.set(drivername=f"{dialect}+{settings.ASYNC_DATABASE_DRIVER}")
+    return url.render_as_string(hide_password=False)
+
+
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, poolclass=TimedAsyncAdaptedQueuePool, **POOL_OPTIONS
+)
+
+replica_engines = [
+    create_engine(url, poolclass=TimedQueuePool, **POOL_OPTIONS)
+    for url in settings.DATABASE_REPLICA_URLS
+]
+async_replica_engines = [
+    create_async_engine(
+        to_async_url(url), poolclass=TimedAsyncAdaptedQueuePool, **POOL_OPTIONS
+    )
+    for url in settings.DATABASE_REPLICA_URLS
+]
+
+replicas = ReplicaSet(engine, replica_engines)
+async_replicas = ReplicaSet(async_engine, async_replica_engines)
+replica_monitor = ReplicaHealthMonitor(
+    [replicas, async_replicas], interval=settings.REPLICA_HEALTH_CHECK_INTERVAL
+)
+
+
+shard_engines = [
+    create_engine(url, poolclass=TimedQueuePool, **POOL_OPTIONS)
+    for url in settings.SHORT_URL_SHARD_URLS
+]
+async_shard_engines = [
+    create_async_engine(
+        to_async_url(url), poolclass=TimedAsyncAdaptedQueuePool, **POOL_OPTIONS
+    )
+    for url in settings.SHORT_URL_SHARD_URLS
+]
+
+short_url_shards = ShardRouter(engine, shard_engines)
+async_short_url_shards = ShardRouter(async_engine, async_shard_engines)
+
+
+class PrimaryReplicaSession(RoutingSession):
+    replica_set = replicas
+
+
+class AsyncPrimaryReplicaSession(RoutingSession):
+    replica_set = async_replicas
+
+
+if short_url_shards.enabled:
+    # replicas are not used once short urls are sharded
+    SessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        class_=ShortUrlShardedSession,
+        router=short_url_shards,
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        autoflush=False,
+        expire_on_commit=False,
+        sync_session_class=ShortUrlShardedSession,
+        router=async_short_url_shards,
+    )
+else:
+    SessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, class_=PrimaryReplicaSession
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        autoflush=False,
+        expire_on_commit=False,
+        sync_session_class=AsyncPrimaryReplicaSession,
+    )
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 db_session = scoped_session(SessionLocal)
 
 Base = declarative_base()
 
 
+def pool_stats(pool) -> dict:
+    """Occupancy and wait times of a connection pool"""
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        **pool.wait_stats.to_dict(),
+    }
+
+
+async def ping_db() -> float:
+    """Run a trivial query, returns its round trip time in seconds"""
+    start = time.perf_counter()
+
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+    return time.perf_counter() - start
+
+
+def _warm_up_engine(connections: int):
+    opened = []
+
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+async def _warm_up_async_engine(connections: int):
+    opened = await asyncio.gather(
+        *(async_engine.connect().start() for _ in range(connections)),
+        return_exceptions=True,
+    )
+
+    for connection in opened:
+        if not isinstance(connection, BaseException):
+            await connection.close()
+
+    for connection in opened:
+        if isinstance(connection, BaseException):
+            raise connection
+
+
+async def warm_up_pools(connections: int):
+    """Open `connections` connections in each pool ahead of traffic, so the
+    first requests don't pay for connection setup. Capped at DB_POOL_SIZE,
+    as overflow connections are closed as soon as they are returned."""
+    connections = min(connections, settings.DB_POOL_SIZE)
+
+    await asyncio.gather(
+        asyncio.to_thread(_warm_up_engine, connections),
+        _warm_up_async_engine(connections),
+    )
+
+
 def init_db():
     """Initialize the database by creating all tables defined by Base metadata."""
     return Base.metadata.create_all(bind=engine)
@@ -28,3 +240,17 @@ def get_db():
         raise
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Yield a new asyncio database session and ensure it's closed after use.
+
+    Meant for `async def` routes, so database I/O is awaited instead of
+    blocking the event loop.
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception as e:
+            print(f"Database Error: {e}")
+            raise
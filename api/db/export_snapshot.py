@@ -0,0 +1,202 @@
+"""Exports every short code's target url and redirect policy to the
+redirect snapshot served in REDIRECT_ONLY_MODE
+
+A full export writes REDIRECT_SNAPSHOT_PATH and removes its delta file::
+
+    python -m api.db.export_snapshot
+
+A delta export writes the links created or updated since the base
+snapshot was exported to its delta file, replacing the previous delta::
+
+    python -m api.db.export_snapshot --delta
+
+It also writes a tombstone for each link deleted since, read from the
+short_url_deletions table. Deleted links then stop redirecting on
+redirect-only hosts that don't share the redirect cache's invalidation
+log. Both only read the rows changed since the base, never the whole
+table.
+
+Run delta exports often, from cron or a loop, and a full export now and
+then to keep the delta small.
+
+Running apps pick up new files within REDIRECT_SNAPSHOT_REFRESH_INTERVAL.
+"""
+
+import argparse
+import heapq
+import os
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from itertools import groupby
+
+from sqlalchemy import delete, func, literal, null, select
+
+from api.core.config import settings
+from api.db.database import engine, short_url_shards
+from api.utils.redirect_snapshot import (
+    DELETED,
+    SnapshotFile,
+    delta_path,
+    write_snapshot,
+)
+from api.v1.models.short_urls import ShortUrl
+from api.v1.models.short_url_deletions import ShortUrlDeletion
+
+# Rows fetched per round trip
+BATCH_SIZE = 10000
+
+# Rows updated this long before the base snapshot may have missed it, as
+# updated_at is set when a transaction starts rather than when it commits
+UPDATE_OVERLAP = 30
+
+# Seconds deletions are remembered after a full export, the rebalance
+# tool's second pass reads them too
+DELETION_RETENTION = 86400
+
+
+def export_rows(stack: ExitStack, since: float = None):
+    """(short_code, target_url, redirect_type, cache_max_age) rows of every
+    shard in short code byte order. When `since` is given, only those
+    updated after it, with their updated_at appended."""
+    table = ShortUrl.__table__
+    columns = [
+        table.c.short_code,
+        table.c.target_url,
+        table.c.redirect_type,
+        table.c.cache_max_age,
+    ]
+
+    if since is not None:
+        columns.append(table.c.updated_at)
+
+    # byte order, whatever the database's default collation
+    stmt = select(*columns).order_by(table.c.short_code.collate("C"))
+
+    if since is not None:
+        stmt = stmt.where(
+            table.c.updated_at >= datetime.fromtimestamp(since, timezone.utc)
+        )
+
+    streams = []
+
+    for shard_id in short_url_shards.shard_ids():
+        conn = stack.enter_context(short_url_shards.engine(shard_id).connect())
+        result = conn.execute(stmt.execution_options(yield_per=BATCH_SIZE))
+        streams.append(iter(result.tuples()))
+
+    # each shard is sorted, merging keeps the order across shards
+    return heapq.merge(*streams, key=lambda row: row[0].encode())
+
+
+def deleted_rows(stack: ExitStack, since: float):
+    """Tombstone rows, with their deletion time appended, of the short
+    urls deleted after `since`, in short code byte order"""
+    table = ShortUrlDeletion.__table__
+    stmt = (
+        select(
+            table.c.short_code,
+            literal(""),
+            literal(DELETED),
+            null(),
+            func.max(table.c.created_at),
+        )
+        .where(table.c.created_at >= datetime.fromtimestamp(since, timezone.utc))
+        .group_by(table.c.short_code)
+        .order_by(table.c.short_code.collate("C"))
+    )
+
+    conn = stack.enter_context(engine.connect())
+    return iter(conn.execute(stmt.execution_options(yield_per=BATCH_SIZE)).tuples())
+
+
+def merge_changes(changed, deleted):
+    """Merge the sorted changed and tombstone rows, both ending with the
+    time they were written at. A short code in both was deleted and
+    created again, or deleted while being exported: the latest wins."""
+    rows = heapq.merge(changed, deleted, key=lambda row: row[0].encode())
+
+    for _, versions in groupby(rows, key=lambda row: row[0]):
+        yield max(versions, key=lambda row: row[-1])[:-1]
+
+
+def prune_deletions(before: float) -> int:
+    """Forget the deletions recorded before `before`, returns how many"""
+    table = ShortUrlDeletion.__table__
+
+    with engine.begin() as conn:
+        return conn.execute(
+            delete(table).where(
+                table.c.created_at < datetime.fromtimestamp(before, timezone.utc)
+            )
+        ).rowcount
+
+
+def export_full(path: str) -> int:
+    """Write the base snapshot, drop its now outdated delta and the
+    deletions it already reflects"""
+    generated_at = time.time()
+
+    with ExitStack() as stack:
+        count = write_snapshot(path, export_rows(stack), generated_at)
+
+    try:
+        os.remove(delta_path(path))
+    except FileNotFoundError:
+        pass
+
+    prune_deletions(generated_at - max(UPDATE_OVERLAP, DELETION_RETENTION))
+
+    return count
+
+
+def export_delta(path: str) -> int:
+    """Write the links changed or deleted since the base snapshot to its
+    delta file"""
+    generated_at = time.time()
+
+    with ExitStack() as stack:
+        base = SnapshotFile(path)
+        stack.callback(base.close)
+
+        since = base.generated_at - UPDATE_OVERLAP
+        changed = export_rows(stack, since=since)
+        deleted = deleted_rows(stack, since=since)
+
+        return write_snapshot(
+            delta_path(path),
+            merge_changes(changed, deleted),
+            generated_at,
+            base_generated_at=base.generated_at,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="only export the links changed or deleted since the base snapshot",
+    )
+    parser.add_argument(
+        "--path",
+        default=settings.REDIRECT_SNAPSHOT_PATH,
+        help="snapshot file, defaults to REDIRECT_SNAPSHOT_PATH",
+    )
+    args = parser.parse_args()
+
+    if args.delta:
+        if not os.path.exists(args.path):
+            parser.error(f"there is no base snapshot at {args.path}, run a full export first")
+
+        print(
+            f"Exported {export_delta(args.path)} changed or deleted short urls "
+            f"to {delta_path(args.path)}"
+        )
+        return
+
+    print(f"Exported {export_full(args.path)} short urls to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""Moves short urls to the shard that owns them after shards are added
+
+Shards can only be appended to SHORT_URL_SHARD_URLS, existing ones keep
+their position on the hash ring so only about 1/N of the short codes move.
+To add shards without downtime:
+
+1. Append the new urls to SHORT_URL_SHARD_URLS in the environment of this
+   tool only, and run it with `--previous` set to the number of shards the
+   app currently uses (0 when short urls still live on the primary)::
+
+       python -m api.db.rebalance --previous 2
+
+   It creates or migrates the short_urls table on every shard and copies each short url
+   whose owner changed to its new shard, leaving the source rows in place.
+   The app keeps serving from the old shards meanwhile. It ends by printing
+   the time it started.
+
+2. Deploy the app with the new SHORT_URL_SHARD_URLS.
+
+3. Run the same command again with `--since` set to that time::
+
+       python -m api.db.rebalance --previous 2 --since 2024-05-01T12:00:00+00:00
+
+   It copies the links created or updated on their old shard between steps
+   1 and 2, a copy never overwrites a more recently updated row, and links
+   deleted since step 1 (recorded in short_url_deletions) are not copied
+   back to their new shard. It then deletes the copies of the links
+   deleted from their old shard meanwhile, which are served from their new
+   shard until then. Without `--since` every row is copied again and
+   deletions are not carried over, the window between steps 1 and 3 then
+   has to be free of deletes. Deletions are pruned a day after they are
+   exported, run this step well within that.
+
+4. Run it once more with `--cleanup` to delete the rows that were moved
+   from the shards that no longer own them, including the old copies of
+   links deleted from their new shard.
+
+`alembic upgrade head` only migrates the primary. After deploying a
+migration that changes short_urls, bring the shards' tables in line with
+the model as well::
+
+    python -m api.db.rebalance --migrate
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from alembic.autogenerate import produce_migrations
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.operations.ops import OpContainer
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from api.db.database import Base, engine, shard_engines
+from api.db.sharding import SHARDED_TABLE, ShardRouter
+from api.v1.models.short_urls import ShortUrl
+from api.v1.models.short_url_deletions import ShortUrlDeletion
+
+# Rows read, copied or deleted per statement
+BATCH_SIZE = 1000
+
+# Rows updated this long before `--since` may have been missed by the first
+# pass, as updated_at is set when a transaction starts rather than when it
+# commits
+UPDATE_OVERLAP = 30
+
+
+def create_tables(router: ShardRouter):
+    """Create the short_urls table and its indexes on every shard. The
+    foreign key to users is left out, users live on the primary."""
+    table = ShortUrl.__table__
+
+    for shard_id in router.shards:
+        with router.engine(shard_id).begin() as conn:
+            conn.execute(
+                CreateTable(table, include_foreign_key_constraints=[], if_not_exists=True)
+            )
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _include_name(name, type_, parent_names) -> bool:
+    return type_ != "table" or name == SHARDED_TABLE
+
+
+def _include_object(obj, name, type_, reflected, compare_to) -> bool:
+    # users live on the primary, so do the foreign keys to them
+    if type_ == "foreign_key_constraint":
+        return False
+
+    return type_ != "table" or name == SHARDED_TABLE
+
+
+def _flatten(operations: list) -> list:
+    flat = []
+
+    for operation in operations:
+        if isinstance(operation, OpContainer):
+            flat += _flatten(operation.ops)
+        else:
+            flat.append(operation)
+
+    return flat
+
+
+def migrate_tables(router: ShardRouter) -> dict:
+    """Create the short_urls table on every shard if it is missing, then
+    apply the column, index and constraint changes alembic's autogenerate
+    finds between each shard's table and the `ShortUrl` model. Returns the
+    number of changes applied by shard id."""
+    create_tables(router)
+    applied = {}
+
+    for shard_id in router.shards:
+        with router.engine(shard_id).begin() as conn:
+            context = MigrationContext.configure(
+                conn,
+                opts={
+                    "include_name": _include_name,
+                    "include_object": _include_object,
+                    "compare_type": True,
+                },
+            )
+            changes = _flatten(produce_migrations(context, Base.metadata).upgrade_ops.ops)
+            operations = Operations(context)
+
+            for change in changes:
+                operations.invoke(change)
+
+            applied[shard_id] = len(changes)
+
+    return applied
+
+
+def deletions_since(since: datetime) -> dict[str, datetime]:
+    """Short code -> time of its latest deletion, for the short urls
+    deleted after `since`"""
+    with engine.connect() as conn:
+        return dict(
+            conn.execute(
+                select(ShortUrlDeletion.short_code, func.max(ShortUrlDeletion.created_at))
+                .where(ShortUrlDeletion.created_at >= since)
+                .group_by(ShortUrlDeletion.short_code)
+            ).all()
+        )
+
+
+def copy_moved_rows(
+    previous: ShardRouter, current: ShardRouter, since: datetime = None
+) -> int:
+    """Copy every short url whose owner differs between `previous` and
+    `current` to its new owner, only those updated after `since` when it is
+    given. Returns the number of rows copied.
+
+    With `since`, rows deleted after they were created are skipped: once
+    the app serves from the new owner, a link deleted there still has its
+    row on the old owner, which must not bring it back.
+    """
+    table = ShortUrl.__table__
+    stmt = select(table)
+    copied = 0
+    deleted_at = {}
+
+    if since is not None:
+        stmt = stmt.where(
+            table.c.updated_at >= since - timedelta(seconds=UPDATE_OVERLAP)
+        )
+        deleted_at = deletions_since(since - timedelta(seconds=UPDATE_OVERLAP))
+
+    for source_id in previous.shard_ids():
+        with previous.engine(source_id).connect() as source:
+            result = source.execute(stmt.execution_options(yield_per=BATCH_SIZE))
+
+            for rows in result.mappings().partitions():
+                rows_by_owner = {}
+
+                for row in rows:
+                    # an alias claimed again after its delete is newer than it
+                    deleted = deleted_at.get(row["short_code"])
+                    if deleted is not None and row["created_at"] <= deleted:
+                        continue
+
+                    owner = current.shard_for(row["short_code"])
+                    if owner != source_id:
+                        rows_by_owner.setdefault(owner, []).append(dict(row))
+
+                for owner, owned_rows in rows_by_owner.items():
+                    stmt = insert(table).values(owned_rows)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[table.c.short_code],
+                        set_={
+                            column.name: stmt.excluded[column.name]
+                            for column in table.columns
+                            if column.name != "short_code"
+                        },
+                        # keep whichever copy was written last
+                        where=table.c.updated_at < stmt.excluded.updated_at,
+                    )
+
+                    with current.engine(owner).begin() as conn:
+                        conn.execute(stmt)
+
+                    copied += len(owned_rows)
+
+    return copied
+
+
+def delete_removed_rows(
+    previous: ShardRouter, current: ShardRouter, since: datetime
+) -> int:
+    """Delete the copies of short urls that no longer exist on their old
+    shard, returns the number of rows deleted
+
+    Only rows created before `since`, the start of the first copy, can be
+    copies: links created on their new shard after the deploy never
+    existed on the old one and are left alone.
+    """
+    table = ShortUrl.__table__
+    deleted = 0
+
+    for owner_id in current.shard_ids():
+        database = current.engine(owner_id)
+
+        with database.connect() as reader:
+            result = reader.execute(
+                select(table.c.short_code)
+                .where(table.c.created_at < since)
+                .execution_options(yield_per=BATCH_SIZE)
+            )
+
+            for short_codes in result.scalars().partitions():
+                copies_by_source = {}
+
+                for short_code in short_codes:
+                    source_id = previous.shard_for(short_code)
+                    if source_id != owner_id:
+                        copies_by_source.setdefault(source_id, []).append(short_code)
+
+                removed = []
+
+                for source_id, copies in copies_by_source.items():
+                    with previous.engine(source_id).connect() as source:
+                        kept = set(
+                            source.execute(
+                                select(table.c.short_code).where(
+                                    table.c.short_code.in_(copies)
+                                )
+                            ).scalars()
+                        )
+
+                    removed += [code for code in copies if code not in kept]
+
+                if removed:
+                    with database.begin() as conn:
+                        conn.execute(
+                            delete(table).where(
+                                table.c.short_code.in_(removed),
+                                table.c.created_at < since,
+                            )
+                        )
+                    deleted += len(removed)
+
+    return deleted
+
+
+def delete_moved_rows(previous: ShardRouter, current: ShardRouter) -> int:
+    """Delete the short urls a database holds but no longer owns, returns
+    the number of rows deleted"""
+    table = ShortUrl.__table__
+    deleted = 0
+
+    for shard_id in dict.fromkeys(previous.shard_ids() + current.shard_ids()):
+        database = current.engine(shard_id)
+
+        with database.connect() as reader:
+            result = reader.execute(
+                select(table.c.short_code).execution_options(yield_per=BATCH_SIZE)
+            )
+
+            for short_codes in result.scalars().partitions():
+                moved = [
+                    short_code
+                    for short_code in short_codes
+                    if current.shard_for(short_code) != shard_id
+                ]
+
+                if moved:
+                    with database.begin() as conn:
+                        conn.execute(delete(table).where(table.c.short_code.in_(moved)))
+                    deleted += len(moved)
+
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--previous",
+        type=int,
+        help="number of shards the app used before the new ones were appended",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        help="start time printed by the first copy, to only copy the rows "
+        "changed since and carry over deletions",
+    )
+    parser.add_argument(
+        "--cleanup",
+        action="store_true",
+        help="delete moved rows from the databases that no longer own them",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="only bring the short_urls table of every shard up to date",
+    )
+    args = parser.parse_args()
+
+    current = ShardRouter(engine, shard_engines)
+
+    if not current.enabled:
+        parser.error("SHORT_URL_SHARD_URLS is empty, there is nothing to rebalance")
+
+    if args.migrate:
+        for shard_id, changes in migrate_tables(current).items():
+            print(f"Applied {changes} schema changes to {shard_id}")
+        return
+
+    if args.previous is None:
+        parser.error("--previous is required to rebalance")
+
+    previous = ShardRouter(engine, shard_engines[: args.previous])
+
+    if args.cleanup:
+        print(f"Deleted {delete_moved_rows(previous, current)} moved short urls")
+        return
+
+    # database time, created_at and updated_at are set by the databases
+    with engine.connect() as conn:
+        started_at = conn.scalar(select(func.now()))
+
+    migrate_tables(current)
+
+    if args.since is None:
+        print(f"Copied {copy_moved_rows(previous, current)} short urls")
+        print(f"Started at {started_at.isoformat()}, pass it as --since to the next run")
+        return
+
+    # naive times are taken to be UTC
+    since = args.since if args.since.tzinfo else args.since.replace(tzinfo=timezone.utc)
+
+    print(f"Copied {copy_moved_rows(previous, current, since)} short urls")
+    print(f"Deleted {delete_removed_rows(previous, current, since)} removed short urls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Routing of read queries to replica databases"""
+
+import asyncio
+import itertools
+import time
+
+from sqlalchemy import Delete, Insert, Select, Update, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+from api.core.config import settings
+from api.utils.cache import LRUCache
+from api.utils.logger import logger
+from api.utils.shared_cache import SharedCache, create_shared_cache
+
+# Session.info key forcing every query of the session onto the primary
+USE_PRIMARY = "use_primary"
+
+
+class ReplicaSet:
+    """A primary engine and its read replicas
+
+    Reads are spread round-robin over the replicas that passed their last
+    health check, and fall back to the primary when none did.
+
+    Args:
+        primary (Engine | AsyncEngine): engine of the primary database
+        replicas (list): engines of the replicas, of the same kind
+    """
+
+    def __init__(self, primary, replicas: list):
+        self.primary = primary
+        self.replicas = replicas
+        self.healthy = list(replicas)
+        self._counter = itertools.count()
+
+    def choose(self):
+        """Engine the next read should go to"""
+        healthy = self.healthy
+
+        if not healthy:
+            return self.primary
+
+        return healthy[next(self._counter) % len(healthy)]
+
+    @staticmethod
+    def _ping(engine) -> bool:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logger.warning(f"Replica {engine.url.host} failed its health check; {e}")
+            return False
+
+    @staticmethod
+    async def _ping_async(engine: AsyncEngine) -> bool:
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logger.warning(f"Replica {engine.url.host} failed its health check; {e}")
+            return False
+
+    async def check(self):
+        """Ping every replica and keep the reachable ones in rotation"""
+        results = await asyncio.gather(
+            *(
+                self._ping_async(replica)
+                if isinstance(replica, AsyncEngine)
+                else asyncio.to_thread(self._ping, replica)
+                for replica in self.replicas
+            )
+        )
+
+        self.healthy = [
+            replica for replica, healthy in zip(self.replicas, results) if healthy
+        ]
+
+    def stats(self) -> dict:
+        return {"configured": len(self.replicas), "healthy": len(self.healthy)}
+
+
+class RoutingSession(Session):
+    """Session sending writes to the primary and reads to a replica
+
+    Once a session has written, or was marked with `use_primary`, all its
+    later queries go to the primary too, so a request always sees its own
+    writes. `SELECT ... FOR UPDATE` always goes to the primary.
+
+    Subclasses set `replica_set`; for an `AsyncSession` it holds async
+    engines and the session binds to their `sync_engine`.
+    """
+
+    replica_set: ReplicaSet = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica_set = self.replica_set
+
+        if not replica_set.replicas:
+            engine = replica_set.primary
+        elif self.info.get(USE_PRIMARY):
+            engine = replica_set.primary
+        elif self._flushing or isinstance(clause, (Insert, Update, Delete)) or (
+            isinstance(clause, Select) and clause._for_update_arg is not None
+        ):
+            self.info[USE_PRIMARY] = True
+            engine = replica_set.primary
+        else:
+            engine = replica_set.choose()
+
+        return getattr(engine, "sync_engine", engine)
+
+    def close(self):
+        super().close()
+        # scoped sessions are reused by the next request of the thread
+        self.info.pop(USE_PRIMARY, None)
+
+
+def use_primary(session):
+    """Send every later query of `session` to the primary"""
+    session.info[USE_PRIMARY] = True
+
+
+class RecentWriters:
+    """Users who wrote in the last `window` seconds, whose reads go to the
+    primary until replicas caught up with their writes
+
+    Kept in this worker's memory and in a `SharedCache`, so the user's next
+    request sees the write whichever worker serves it. When the shared
+    cache fails, users count as recent writers: reading from the primary
+    is slower, not wrong.
+
+    Args:
+        shared (SharedCache): cache shared by the workers, None to only
+            remember this worker's writers
+        window (float): seconds a user reads from the primary after a write
+        maxsize (int, optional): users remembered in memory. Defaults to
+            10000.
+    """
+
+    # seconds between two removals of expired users from the shared cache
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, shared: SharedCache, window: float, maxsize: int = 10000):
+        self.shared = shared
+        self.window = window
+        self.local = LRUCache(maxsize=maxsize, ttl=window)
+        self._pruned_at = time.monotonic()
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"recent-writer:{user_id}"
+
+    def mark(self, user_id: str):
+        self.local.set(user_id, True)
+
+        if self.shared is None:
+            return
+
+        try:
+            self.shared.set(self._key(user_id), True, self.window)
+
+            if time.monotonic() - self._pruned_at >= self.PRUNE_INTERVAL:
+                self._pruned_at = time.monotonic()
+                self.shared.prune(self.window)
+        except Exception as e:
+            logger.exception(f"Failed to share the recent write of {user_id}; {e}")
+
+    def contains(self, user_id: str) -> bool:
+        if self.local.get(user_id) is not None:
+            return True
+
+        if self.shared is None:
+            return False
+
+        try:
+            return self.shared.get(self._key(user_id)) is not None
+        except Exception as e:
+            logger.exception(f"Failed to read recent writers; {e}")
+            return True
+
+
+# users who wrote in the last READ_YOUR_WRITES_WINDOW seconds, only needed
+# with read replicas
+recent_writers = RecentWriters(
+    create_shared_cache(settings.REDIRECT_L2_CACHE, settings.RECENT_WRITERS_PATH)
+    if settings.DATABASE_REPLICA_URLS
+    else None,
+    window=settings.READ_YOUR_WRITES_WINDOW,
+    maxsize=settings.USER_CACHE_SIZE,
+)
+
+
+def mark_recent_writer(user_id: str):
+    """Read from the primary for this user for a while, until replicas have
+    caught up with the write they just made. Blocking, call it from a
+    thread when the shared cache is remote."""
+    if settings.DATABASE_REPLICA_URLS:
+        recent_writers.mark(user_id)
+
+
+def is_recent_writer(user_id: str) -> bool:
+    if not settings.DATABASE_REPLICA_URLS:
+        return False
+
+    return recent_writers.contains(user_id)
+
+
+class ReplicaHealthMonitor:
+    """Background task health checking replica sets every `interval` seconds
+
+    Args:
+        replica_sets (list[ReplicaSet]): replica sets to check
+        interval (float): seconds between two rounds of checks
+    """
+
+    def __init__(self, replica_sets: list, interval: float = 5):
+        self.replica_sets = replica_sets
+        self.interval = interval
+        self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(*(replica_set.check() for replica_set in self.replica_sets))
+
+    def start(self):
+        """Start checking in the background, if any replica is configured"""
+        if self._task is None and any(rs.replicas for rs in self.replica_sets):
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
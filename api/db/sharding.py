@@ -0,0 +1,178 @@
+"""Horizontal sharding of the short_urls table by short code"""
+
+import bisect
+import hashlib
+
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+
+# Shard id of the primary database, which holds every other table
+PRIMARY = "primary"
+
+# The only table split across shards
+SHARDED_TABLE = "short_urls"
+
+
+def shard_ids_for(count: int) -> list[str]:
+    """Ids of the shards configured in SHORT_URL_SHARD_URLS, in order"""
+    return [f"shard_{index}" for index in range(count)]
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to shard ids
+
+    Every shard is placed at `vnodes` points of a 64-bit ring, and a key
+    belongs to the first point after its own hash. Adding a shard only
+    moves the keys that now land on its points, about 1/N of them, instead
+    of reshuffling almost every key like `hash % N` would.
+
+    Args:
+        shard_ids (list[str]): shards on the ring
+        vnodes (int, optional): points per shard. Defaults to 128.
+    """
+
+    def __init__(self, shard_ids: list[str], vnodes: int = 128):
+        points = sorted(
+            (self._hash(f"{shard_id}#{index}"), shard_id)
+            for shard_id in shard_ids
+            for index in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shard_ids = [shard_id for _, shard_id in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def shard_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._shard_ids[index]
+
+
+def _is_sharded(mapper) -> bool:
+    return mapper is not None and mapper.local_table.name == SHARDED_TABLE
+
+
+def short_codes_in(statement) -> set:
+    """Short codes a statement is restricted to through `short_code = x` or
+    `short_code IN (...)` criteria, empty if it isn't"""
+    whereclause = getattr(statement, "whereclause", None)
+    codes = set()
+
+    if whereclause is None:
+        return codes
+
+    for element in visitors.iterate(whereclause):
+        if not (
+            isinstance(element, BinaryExpression)
+            and isinstance(element.right, BindParameter)
+            and getattr(element.left, "name", None) == "short_code"
+            and getattr(getattr(element.left, "table", None), "name", None) == SHARDED_TABLE
+        ):
+            continue
+
+        if element.operator is operators.eq:
+            codes.add(element.right.effective_value)
+        elif element.operator is operators.in_op:
+            codes.update(element.right.effective_value)
+
+    return codes
+
+
+class ShardRouter:
+    """Tells which database holds the short url of a short code
+
+    Short urls are spread over the shards with a `HashRing`, and every
+    other table stays on the primary. Without shards, short urls stay on
+    the primary too.
+
+    Args:
+        primary (Engine | AsyncEngine): engine of the primary database
+        shards (list): engines of the shards, in SHORT_URL_SHARD_URLS order
+    """
+
+    def __init__(self, primary, shards: list):
+        self.primary = primary
+        self.shards = dict(zip(shard_ids_for(len(shards)), shards))
+        self.ring = HashRing(list(self.shards)) if shards else None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shards)
+
+    def shard_ids(self) -> list[str]:
+        """Ids of every database holding short urls"""
+        return list(self.shards) or [PRIMARY]
+
+    def shard_for(self, short_code: str) -> str:
+        if not self.enabled:
+            return PRIMARY
+
+        return self.ring.shard_for(short_code)
+
+    def engine(self, shard_id: str):
+        return self.primary if shard_id == PRIMARY else self.shards[shard_id]
+
+    def engine_for(self, short_code: str):
+        return self.engine(self.shard_for(short_code))
+
+    def session_binds(self) -> dict:
+        """Sync engines by shard id, as `ShardedSession` expects them"""
+        return {
+            shard_id: getattr(engine, "sync_engine", engine)
+            for shard_id, engine in {PRIMARY: self.primary, **self.shards}.items()
+        }
+
+    def shard_chooser(self, mapper, instance, clause=None) -> str:
+        """Shard an instance is written to"""
+        if not _is_sharded(mapper):
+            return PRIMARY
+
+        if instance is not None:
+            return self.shard_for(instance.short_code)
+
+        codes = short_codes_in(clause)
+
+        if len(codes) != 1:
+            raise ValueError("cannot tell which shard the short url statement targets")
+
+        return self.shard_for(codes.pop())
+
+    def identity_chooser(self, mapper, primary_key, *, lazy_loaded_from, **kwargs) -> list:
+        """Shards a row could be on, given its primary key"""
+        if not _is_sharded(mapper):
+            return [PRIMARY]
+
+        if lazy_loaded_from is not None and lazy_loaded_from.identity_token in self.shards:
+            return [lazy_loaded_from.identity_token]
+
+        # ids don't tell the shard, only short codes do
+        return self.shard_ids()
+
+    def execute_chooser(self, context) -> list:
+        """Shards an ORM statement has to run on"""
+        if not any(_is_sharded(mapper) for mapper in context.all_mappers):
+            return [PRIMARY]
+
+        codes = short_codes_in(context.statement)
+
+        if codes:
+            return sorted({self.shard_for(code) for code in codes})
+
+        return self.shard_ids()
+
+
+class ShortUrlShardedSession(ShardedSession):
+    """`ShardedSession` routed by a `ShardRouter`. Queries on a short code
+    run on its shard only, other short url queries run on every shard one
+    after the other and their rows are concatenated."""
+
+    def __init__(self, router: ShardRouter, **kwargs):
+        super().__init__(
+            shard_chooser=router.shard_chooser,
+            identity_chooser=router.identity_chooser,
+            execute_chooser=router.execute_chooser,
+            shards=router.session_binds(),
+            **kwargs,
+        )
@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import math
+import threading
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from api.core.config import settings
+from api.db.database import async_short_url_shards
+from api.db.sharding import ShardRouter
+from api.utils.logger import logger
+from api.utils.shared_cache import SharedCache, create_shared_cache
+from api.v1.models.short_urls import ShortUrl
+
+
+class BloomFilter:
+    """Bloom filter answering "definitely absent" or "possibly present"
+
+    Sized for `capacity` items at a false positive rate of `error_rate`,
+    which takes about `-capacity * ln(error_rate) / ln(2) ** 2` bits.
+
+    Args:
+        capacity (int): number of items the filter is sized for
+        error_rate (float): false positive rate once `capacity` items are in
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+
+        # double hashing, k positions out of two hashes
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        positions = list(self._positions(item))
+
+        # bytes are read-modify-written, so concurrent adds must not interleave
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class ShortCodeFilter:
+    """Bloom filter of every existing short code, so redirects for codes
+    that definitely don't exist are answered without a database query
+
+    The filter is built from the `short_urls` table at startup and rebuilt
+    every `rebuild_interval` seconds, which also drops deleted codes and
+    resizes it as the table grows. Workers `publish` the codes they create
+    to the log of a `SharedCache` once committed, and a code missing from
+    the filter is only reported absent after a read of the log started
+    after the lookup, so a new link never 404s on another worker sharing
+    the log. Lookups missing the filter meanwhile share that read, and
+    reads start at most every `log_read_interval` seconds, so scans of
+    unknown codes cost a few log reads per second, not one per request.
+    The database is also read for new codes every `sync_interval`
+    seconds, in case a publish failed.
+
+    Only workers sharing the log are covered: with the "sqlite" log, the
+    workers of one host. A code created on another host may 404 until the
+    next sync, up to `sync_interval` seconds.
+
+    The filter stays disabled without a shared log, as it would miss the
+    codes of other workers. Until the first build completes, or when the
+    log can't be read, every code is reported as possibly present.
+
+    Args:
+        shards (ShardRouter): async engines the short codes are read from
+        log (SharedCache): log the workers publish new codes to, None to
+            disable the filter
+        capacity (int): minimum number of codes the filter is sized for
+        error_rate (float): false positive rate
+        sync_interval (float): seconds between two reads of new codes
+        rebuild_interval (float): seconds between two full rebuilds
+        log_read_interval (float): minimum seconds between two reads of the
+            log by lookups
+    """
+
+    # overlap between two syncs, covers transactions that commit a while
+    # after their created_at timestamp
+    SYNC_OVERLAP = timedelta(seconds=30)
+
+    # log entries older than this are pruned
+    LOG_RETENTION = 3600
+
+    def __init__(
+        self,
+        shards: ShardRouter,
+        log: SharedCache = None,
+        capacity: int = 1000000,
+        error_rate: float = 0.01,
+        sync_interval: float = 2,
+        rebuild_interval: float = 3600,
+        log_read_interval: float = 0.05,
+    ):
+        self.shards = shards
+        self.log = log
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.log_read_interval = log_read_interval
+        self.filter = None
+        self.log_reads = 0
+        self.rejected = 0
+        # shard id -> database time of the last read of that shard
+        self._synced_at = {}
+        self._added_while_building = None
+        self._position = None
+        self._unpublished = []
+        self._next_read = None
+        self._last_read_at = None
+        self._task = None
+
+    async def might_exist(self, short_code: str) -> bool:
+        """False only if `short_code` definitely does not exist"""
+        if self.filter is None or short_code in self.filter:
+            return True
+
+        # it may have been created by another worker since the last read
+        if self._next_read is None:
+            self._next_read = asyncio.create_task(self._scheduled_read())
+            # mark the exception retrieved, in case every lookup was cancelled
+            self._next_read.add_done_callback(
+                lambda done: done.cancelled() or done.exception()
+            )
+
+        try:
+            await asyncio.shield(self._next_read)
+        except Exception as e:
+            logger.exception(f"Failed to read the short code log; {e}")
+            return True
+
+        if short_code in self.filter:
+            return True
+
+        self.rejected += 1
+        return False
+
+    async def _scheduled_read(self):
+        """Read the log for the lookups that missed the filter until the
+        read starts"""
+        loop = asyncio.get_running_loop()
+
+        if self._last_read_at is not None:
+            await asyncio.sleep(self._last_read_at + self.log_read_interval - loop.time())
+
+        # lookups from now on need a read that starts after them
+        self._next_read = None
+        self._last_read_at = loop.time()
+        self.log_reads += 1
+        await asyncio.to_thread(self._read_log)
+
+    def add(self, short_code: str):
+        """Record a short code in this worker's filter"""
+        if self._added_while_building is not None:
+            self._added_while_building.append(short_code)
+
+        if self.filter is not None:
+            self.filter.add(short_code)
+
+    def publish(self, short_codes: list[str]):
+        """Record committed short codes and announce them to the other
+        workers. Blocking, call it from a thread."""
+        for short_code in short_codes:
+            self.add(short_code)
+
+        if self.log is None:
+            return
+
+        try:
+            self.log.publish_invalidations(short_codes)
+        except Exception as e:
+            # retried by the background task, sync() covers them meanwhile
+            logger.exception(f"Failed to publish new short codes; {e}")
+            self._unpublished.extend(short_codes)
+
+    def _read_log(self):
+        """Add the codes published since the last read of the log"""
+        entries = self.log.invalidations_since(self._position)
+
+        for _, short_code in entries:
+            self.add(short_code)
+
+        if entries:
+            self._position = max(self._position, entries[-1][0])
+
+    def _maintain_log(self):
+        unpublished, self._unpublished = self._unpublished, []
+
+        if unpublished:
+            try:
+                self.log.publish_invalidations(unpublished)
+            except Exception:
+                self._unpublished.extend(unpublished)
+                raise
+
+        self.log.prune(self.LOG_RETENTION)
+
+    async def rebuild(self):
+        """Build a new filter from every short code in the database"""
+        if self._position is None:
+            # codes published from here on are read after the build
+            self._position = await asyncio.to_thread(self.log.last_invalidation)
+
+        self._added_while_building = []
+
+        try:
+            count = 0
+            for shard_id in self.shards.shard_ids():
+                async with self.shards.engine(shard_id).connect() as conn:
+                    count += await conn.scalar(
+                        select(func.count()).select_from(ShortUrl)
+                    )
+
+            new_filter = BloomFilter(
+                capacity=max(self.capacity, int(count * 1.25)),
+                error_rate=self.error_rate,
+            )
+            synced_at = {}
+
+            for shard_id in self.shards.shard_ids():
+                async with self.shards.engine(shard_id).connect() as conn:
+                    synced_at[shard_id] = await conn.scalar(select(func.now()))
+                    result = await conn.stream(
+                        select(ShortUrl.short_code).execution_options(yield_per=10000)
+                    )
+
+                    async for short_code in result.scalars():
+                        new_filter.add(short_code)
+
+            for short_code in self._added_while_building:
+                new_filter.add(short_code)
+
+            self.filter = new_filter
+            self._synced_at = synced_at
+        finally:
+            self._added_while_building = None
+
+    async def sync(self):
+        """Add the short codes created since the last sync, by any worker"""
+        for shard_id in self.shards.shard_ids():
+            async with self.shards.engine(shard_id).connect() as conn:
+                synced_at = await conn.scalar(select(func.now()))
+                short_codes = await conn.scalars(
+                    select(ShortUrl.short_code).where(
+                        ShortUrl.created_at
+                        >= self._synced_at[shard_id] - self.SYNC_OVERLAP
+                    )
+                )
+
+                for short_code in short_codes:
+                    self.filter.add(short_code)
+
+            self._synced_at[shard_id] = synced_at
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_rebuild = last_maintenance = loop.time()
+
+        while True:
+            await asyncio.sleep(self.sync_interval)
+
+            try:
+                if self.filter is None or loop.time() - last_rebuild >= self.rebuild_interval:
+                    await self.rebuild()
+                    last_rebuild = loop.time()
+                else:
+                    await self.sync()
+
+                if self._unpublished or loop.time() - last_maintenance >= self.LOG_RETENTION / 10:
+                    await asyncio.to_thread(self._maintain_log)
+                    last_maintenance = loop.time()
+            except Exception as e:
+                logger.exception(f"Failed to refresh the short code filter; {e}")
+
+    async def start(self):
+        """Build the filter, then keep it up to date in the background"""
+        if self.log is None:
+            logger.warning("The short code filter needs a shared log, it stays disabled")
+            return
+
+        try:
+            await self.rebuild()
+        except Exception as e:
+            # redirects fall back to the database until a rebuild succeeds
+            logger.exception(f"Failed to build the short code filter; {e}")
+
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        if self.filter is None:
+            return {"ready": False, "rejected": self.rejected, "log_reads": self.log_reads}
+
+        return {
+            "ready": True,
+            "codes": self.filter.count,
+            "capacity": self.filter.capacity,
+            "error_rate": self.filter.error_rate,
+            "memory_bytes": len(self.filter.bits),
+            "hash_count": self.filter.hash_count,
+            "rejected": self.rejected,
+            "log_reads": self.log_reads,
+        }
+
+
+short_code_filter = ShortCodeFilter(
+    shards=async_short_url_shards,
+    log=create_shared_cache(settings.REDIRECT_L2_CACHE, settings.BLOOM_FILTER_LOG_PATH),
+    capacity=settings.BLOOM_FILTER_CAPACITY,
+    error_rate=settings.BLOOM_FILTER_ERROR_RATE,
+    sync_interval=settings.BLOOM_FILTER_SYNC_INTERVAL,
+    rebuild_interval=settings.BLOOM_FILTER_REBUILD_INTERVAL,
+    log_read_interval=settings.BLOOM_FILTER_LOG_READ_INTERVAL,
+)
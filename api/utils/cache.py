@@ -0,0 +1,429 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from api.utils.logger import logger
+from api.utils.shared_cache import SharedCache
+
+
+class LRUCache:
+    """Bounded, thread safe in-memory cache with least-recently-used eviction
+    and a per entry time-to-live.
+
+    Args:
+        maxsize (int): maximum number of entries kept in memory
+        ttl (float): default number of seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key`, or `default` if it is
+        missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """Caches `value` under `key`, evicting the least recently used
+        entry if the cache is full"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Removes `key` from the cache if present"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        """Removes every entry whose value matches `predicate`"""
+        with self._lock:
+            for key in [
+                key for key, (value, _) in self._data.items() if predicate(value)
+            ]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Returns the cache counters, useful for tuning size and ttl"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TwoTierCache:
+    """Per-process `LRUCache` in front of a `SharedCache` shared by every
+    worker
+
+    Misses are filled by `load`, which checks the shared cache, then calls
+    the loader. Concurrent misses on the same key within a worker wait for
+    the first one's result instead of all calling the loader, so a hot key
+    expiring costs one query, not one per request.
+
+    `invalidate` drops a key from both tiers and appends it to the shared
+    cache's invalidation log, which every worker polls to drop the key
+    from its own memory. A loaded value written to the shared tier is
+    deleted again if its key was invalidated since the load started, as
+    the loader may have read it before the change, e.g. from a lagging
+    replica. The shared tier is best effort: when it fails, lookups fall
+    through to the loader.
+
+    Args:
+        local (LRUCache): in-process first tier
+        shared (SharedCache, optional): shared second tier, None to only
+            use the first one
+        shared_ttl (float, optional): seconds values stay in the shared
+            tier. Defaults to 3600.
+        poll_interval (float, optional): seconds between two reads of the
+            invalidation log. Defaults to 1.
+        on_invalidate (Callable[[str], None], optional): called with every
+            key dropped from this worker, for other copies of the data
+        version (str, optional): prefix of the keys of the values in the
+            shared tier, bump it when their format changes. The invalidation
+            log keeps the bare keys.
+    """
+
+    # invalidation log entries older than this are pruned
+    LOG_RETENTION = 3600
+
+    def __init__(
+        self,
+        local: LRUCache,
+        shared: SharedCache = None,
+        shared_ttl: float = 3600,
+        poll_interval: float = 1,
+        on_invalidate=None,
+        version: str = "",
+    ):
+        self.local = local
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.poll_interval = poll_interval
+        self.on_invalidate = on_invalidate
+        self.version = version
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        self.loads = 0
+        self.coalesced = 0
+        self._loading = {}
+        self._stale = set()
+        self._position = None
+        self._task = None
+
+    def get(self, key, default=None):
+        """Value of `key` in this worker's memory"""
+        return self.local.get(key, default)
+
+    def _shared_call(self, method, *args):
+        try:
+            return method(*args)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.exception(f"Shared cache {method.__name__} failed; {e}")
+            return None
+
+    def _shared_key(self, key) -> str:
+        return f"{self.version}:{key}" if self.version else key
+
+    def _shared_get(self, key):
+        """Value of `key` in the shared tier, and the invalidation log
+        position it was read at"""
+        position = self._shared_call(self.shared.last_invalidation)
+        return self._shared_call(self.shared.get, self._shared_key(key)), position
+
+    def _shared_set(self, key, value, position):
+        if position is None:
+            # can't tell whether the value is outdated, keep it local
+            return
+
+        self._shared_call(self.shared.set, self._shared_key(key), value, self.shared_ttl)
+
+        # an invalidation published since the load started may have been
+        # for a write the loader didn't see, the value must not outlive it
+        invalidations = self._shared_call(self.shared.invalidations_since, position)
+
+        if invalidations is None or any(entry[1] == key for entry in invalidations):
+            self._shared_call(self.shared.delete, self._shared_key(key))
+
+    async def _fill(self, key, loader):
+        position = None
+
+        if self.shared is not None:
+            value, position = await asyncio.to_thread(self._shared_get, key)
+
+            if value is not None:
+                self.shared_hits += 1
+                return value, False, None
+
+            self.shared_misses += 1
+
+        self.loads += 1
+        return await loader(), True, position
+
+    async def load(self, key, loader):
+        """Value of `key` from the shared tier or `loader`, a coroutine
+        function, caching it in both tiers. Exceptions of the loader are
+        raised to every request waiting on the key."""
+        while True:
+            pending = self._loading.get(key)
+
+            if pending is None:
+                break
+
+            self.coalesced += 1
+            await asyncio.wait([pending])
+
+            # a cancelled first request leaves the load to the next one
+            if not pending.cancelled():
+                return pending.result()
+
+        future = asyncio.get_running_loop().create_future()
+        # mark the exception retrieved, in case nobody else waited
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._loading[key] = future
+        self._stale.discard(key)
+
+        try:
+            value, loaded, position = await self._fill(key, loader)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._loading.pop(key, None)
+
+        # invalidated while loading, the value may already be outdated
+        if key not in self._stale:
+            self.local.set(key, value)
+
+            if loaded and self.shared is not None:
+                await asyncio.to_thread(self._shared_set, key, value, position)
+
+        future.set_result(value)
+        return value
+
+    def _drop(self, key):
+        self.local.delete(key)
+
+        if self.on_invalidate is not None:
+            self.on_invalidate(key)
+
+        if key in self._loading:
+            self._stale.add(key)
+
+    def invalidate(self, key):
+        """Drop `key` from every worker's cache. Blocking, call it from a
+        thread when the shared tier is remote."""
+        self._drop(key)
+
+        if self.shared is not None:
+            # published first, so a concurrent load either sees it or
+            # writes its value before this delete
+            self._shared_call(self.shared.publish_invalidation, key)
+            self._shared_call(self.shared.delete, self._shared_key(key))
+
+    def _poll(self) -> list:
+        if self._position is None:
+            self._position = self.shared.last_invalidation()
+            return []
+
+        entries = self.shared.invalidations_since(self._position)
+
+        if entries:
+            self._position = entries[-1][0]
+
+        return [key for _, key in entries]
+
+    async def run(self):
+        polls = 0
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            try:
+                for key in await asyncio.to_thread(self._poll):
+                    self._drop(key)
+
+                polls += 1
+                if polls * self.poll_interval >= self.LOG_RETENTION / 10:
+                    polls = 0
+                    await asyncio.to_thread(self.shared.prune, self.LOG_RETENTION)
+            except Exception as e:
+                logger.exception(f"Failed to read the cache invalidation log; {e}")
+
+    async def start(self):
+        """Start following the invalidation log of the shared tier"""
+        if self.shared is not None and self._task is None:
+            await asyncio.to_thread(self._shared_call, self._poll)
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            **self.local.stats(),
+            "shared": type(self.shared).__name__ if self.shared else None,
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "shared_errors": self.shared_errors,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+        }
+
+
+class SharedInvalidations:
+    """Drops keys from every worker's caches through the invalidation log
+    of a `SharedCache`, for caches that don't go through a `TwoTierCache`
+
+    `publish` drops the keys from this worker and appends them to the log,
+    which every worker polls to drop them in turn. Without a log, or when
+    publishing fails, keys are only dropped from this worker.
+
+    Args:
+        log (SharedCache): shared invalidation log, None to only drop keys
+            from this worker
+        on_invalidate (Callable[[str], None]): drops a key from this
+            worker's caches
+        poll_interval (float, optional): seconds between two reads of the
+            log. Defaults to 1.
+    """
+
+    # log entries older than this are pruned
+    LOG_RETENTION = 3600
+
+    def __init__(self, log: SharedCache, on_invalidate, poll_interval: float = 1):
+        self.log = log
+        self.on_invalidate = on_invalidate
+        self.poll_interval = poll_interval
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+        self._position = None
+        self._task = None
+
+    def publish(self, keys: list[str]):
+        """Drop `keys` from every worker. Blocking, call it from a thread
+        when the log is remote."""
+        for key in keys:
+            self.on_invalidate(key)
+
+        if self.log is None or not keys:
+            return
+
+        try:
+            self.log.publish_invalidations(keys)
+            self.published += len(keys)
+        except Exception as e:
+            self.errors += 1
+            logger.exception(f"Failed to publish invalidations of {keys}; {e}")
+
+    def _poll(self) -> list:
+        if self._position is None:
+            self._position = self.log.last_invalidation()
+            return []
+
+        entries = self.log.invalidations_since(self._position)
+
+        if entries:
+            self._position = entries[-1][0]
+
+        return [key for _, key in entries]
+
+    async def run(self):
+        polls = 0
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            try:
+                for key in await asyncio.to_thread(self._poll):
+                    self.received += 1
+                    self.on_invalidate(key)
+
+                polls += 1
+                if polls * self.poll_interval >= self.LOG_RETENTION / 10:
+                    polls = 0
+                    await asyncio.to_thread(self.log.prune, self.LOG_RETENTION)
+            except Exception as e:
+                self.errors += 1
+                logger.exception(f"Failed to read the invalidation log; {e}")
+
+    async def start(self):
+        """Start following the log"""
+        if self.log is None or self._task is not None:
+            return
+
+        try:
+            await asyncio.to_thread(self._poll)
+        except Exception as e:
+            self.errors += 1
+            logger.exception(f"Failed to read the invalidation log; {e}")
+
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "log": type(self.log).__name__ if self.log else None,
+            "published": self.published,
+            "received": self.received,
+            "errors": self.errors,
+        }
@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import threading
+import time
+
+import httpx
+
+from api.core.config import settings
+from api.utils.logger import logger
+
+
+class CdnPurger:
+    """Tells the CDN in front of the redirects to drop its cached copies
+
+    Subclass it to plug in a CDN's purge API. `purge` is blocking and runs
+    on the `CdnPurges` thread, off the request path.
+    """
+
+    def purge(self, paths: list[str]):
+        """Purge the responses cached for `paths`, e.g. ["/abc1234"]"""
+        raise NotImplementedError
+
+
+class WebhookCdnPurger(CdnPurger):
+    """POSTs `{"paths": [...]}` to a url, for CDNs purged through a small
+    adapter service or a serverless function
+
+    Args:
+        url (str): endpoint receiving the purge requests
+        timeout (float, optional): seconds to wait for it. Defaults to 5.
+    """
+
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+
+    def purge(self, paths: list[str]):
+        response = httpx.post(self.url, json={"paths": paths}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class CdnPurges:
+    """Sends purges for changed short urls to a `CdnPurger` in the
+    background, one at a time
+
+    Each change is purged right away, then again after `delay`: until
+    every worker dropped the old target, a request reaching one of them
+    puts it back in the CDN. Failed purges are retried with a doubling
+    backoff, up to `attempts` times.
+
+    Redirect-only hosts that don't share the invalidation log serve the
+    old target until a delta export reaches them, the second purge only
+    helps if the export runs within `delay`.
+
+    Args:
+        purger (CdnPurger, optional): CDN to purge, None to do nothing
+        delay (float, optional): seconds before the second purge, 0 to
+            purge once. Defaults to 10.
+        attempts (int, optional): attempts at a purge before it counts as
+            failed. Defaults to 5.
+        retry_delay (float, optional): seconds before the first retry.
+            Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        purger: CdnPurger = None,
+        delay: float = 10,
+        attempts: int = 5,
+        retry_delay: float = 1,
+    ):
+        self.purger = purger
+        self.delay = delay
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        # (due time, sequence, paths, attempt) heap
+        self._pending = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def _schedule(self, due: float, paths: list[str], attempt: int = 1):
+        heapq.heappush(self._pending, (due, next(self._sequence), paths, attempt))
+        self._condition.notify()
+
+    def _next(self):
+        """Wait for the next due purge, None once stopping with nothing
+        left to send"""
+        with self._condition:
+            while True:
+                if self._pending:
+                    wait = self._pending[0][0] - time.monotonic()
+
+                    # on shutdown, the delayed purges are sent right away
+                    if wait <= 0 or self._stopping:
+                        return heapq.heappop(self._pending)
+                elif self._stopping:
+                    return None
+                else:
+                    wait = None
+
+                self._condition.wait(wait)
+
+    def _run(self):
+        while (item := self._next()) is not None:
+            _, _, paths, attempt = item
+
+            try:
+                self.purger.purge(paths)
+                self.sent += 1
+            except Exception as e:
+                with self._condition:
+                    if attempt < self.attempts and not self._stopping:
+                        self.retried += 1
+                        due = time.monotonic() + self.retry_delay * 2 ** (attempt - 1)
+                        self._schedule(due, paths, attempt + 1)
+                        logger.warning(f"CDN purge of {paths} failed, retrying; {e}")
+                        continue
+
+                self.failed += 1
+                logger.exception(f"CDN purge of {paths} failed; {e}")
+
+    def purge_short_codes(self, short_codes: list[str]):
+        """Purge the redirects of `short_codes`, without waiting for it"""
+        if self.purger is None:
+            return
+
+        paths = [f"/{short_code}" for short_code in short_codes]
+
+        with self._condition:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(
+                    target=self._run, name="cdn-purge", daemon=True
+                )
+                self._thread.start()
+
+            now = time.monotonic()
+            self._schedule(now, paths)
+
+            if self.delay > 0:
+                self._schedule(now + self.delay, paths)
+
+    def shutdown(self):
+        """Send the pending purges, delayed ones included, and stop"""
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify()
+
+        if thread is not None:
+            thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "purger": type(self.purger).__name__ if self.purger else None,
+            "pending": len(self._pending),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+cdn_purges = CdnPurges(
+    WebhookCdnPurger(settings.CDN_PURGE_WEBHOOK_URL)
+    if settings.CDN_PURGE_WEBHOOK_URL
+    else None,
+    delay=settings.CDN_PURGE_DELAY,
+    attempts=settings.CDN_PURGE_ATTEMPTS,
+)
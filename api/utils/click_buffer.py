@@ -0,0 +1,155 @@
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import Integer, String, column, func, update, values
+from api.core.config import settings
+from api.db.database import async_short_url_shards
+from api.db.sharding import ShardRouter
+from api.utils.logger import logger
+from api.v1.models.short_urls import ShortUrl
+
+
+class ClickBuffer:
+    """Write-behind counter for short url clicks
+
+    Clicks are accumulated in memory per short code and periodically written
+    with one `UPDATE ... SET access_count = access_count + n` statement per
+    batch, instead of one UPDATE (and row lock) per redirect.
+
+    Args:
+        shards (ShardRouter): async engines the batched updates are run
+            on, each short code is updated on its own shard
+        flush_interval (float): seconds between two flushes
+        max_batch_size (int): maximum number of short codes updated by a
+            single statement. A flush is also triggered early once this many
+            short codes have pending clicks.
+        max_backoff (float): longest wait between two flushes while they
+            fail, the wait doubles from `flush_interval` after each failure
+    """
+
+    def __init__(
+        self,
+        shards: ShardRouter,
+        flush_interval: float = 5,
+        max_batch_size: int = 1000,
+        max_backoff: float = 60,
+    ):
+        self.shards = shards
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_backoff = max_backoff
+        self._pending = defaultdict(int)
+        # flushes failed in a row
+        self._failures = 0
+        self._flush_requested = None
+        self._stopping = False
+        self._task = None
+
+    def add(self, short_code: str, count: int = 1):
+        """Record `count` clicks for `short_code`"""
+        self._pending[short_code] += count
+
+        # no early flush while the database fails, it would only fail again
+        if (
+            self._flush_requested
+            and not self._failures
+            and len(self._pending) >= self.max_batch_size
+        ):
+            self._flush_requested.set()
+
+    def pending(self) -> int:
+        """Number of short codes with clicks not yet written"""
+        return len(self._pending)
+
+    async def flush(self):
+        """Write all pending clicks to the database"""
+        pending, self._pending = self._pending, defaultdict(int)
+        items_by_shard = defaultdict(list)
+        failed = False
+
+        for short_code, count in pending.items():
+            items_by_shard[self.shards.shard_for(short_code)].append((short_code, count))
+
+        for shard_id, items in items_by_shard.items():
+            # every worker locks rows in the same order, so concurrent
+            # flushes wait on each other instead of deadlocking
+            items.sort()
+
+            for start in range(0, len(items), self.max_batch_size):
+                batch = items[start : start + self.max_batch_size]
+
+                try:
+                    await self._write(shard_id, batch)
+                except Exception as e:
+                    logger.exception(f"Failed to flush click counts; {e}")
+                    # keep the counts around for the next flush
+                    for short_code, count in items[start:]:
+                        self._pending[short_code] += count
+                    failed = True
+                    break
+
+        self._failures = self._failures + 1 if failed else 0
+
+    async def _write(self, shard_id: str, batch):
+        table = ShortUrl.__table__
+        clicks = values(
+            column("short_code", String), column("clicks", Integer), name="clicks"
+        ).data(batch)
+
+        stmt = (
+            update(table)
+            .where(table.c.short_code == clicks.c.short_code)
+            .values(
+                access_count=func.coalesce(table.c.access_count, 0) + clicks.c.clicks,
+                # clicks don't change the link: keeps it out of snapshot
+                # deltas, and the update HOT as no indexed column changes
+                updated_at=table.c.updated_at,
+            )
+        )
+
+        async with self.shards.engine(shard_id).begin() as conn:
+            await conn.execute(stmt)
+
+    async def run(self):
+        """Flush pending clicks every `flush_interval` seconds, or sooner
+        when a full batch is waiting. Backs off while flushes fail."""
+        while not self._stopping:
+            timeout = self.flush_interval
+
+            if self._failures:
+                # capped exponent, a long outage must not overflow the float
+                timeout = min(timeout * 2 ** min(self._failures, 16), self.max_backoff)
+
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            self._flush_requested.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None:
+            self._flush_requested = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background task and flush whatever is still pending"""
+        if self._task is not None:
+            # let an in-progress flush finish instead of cancelling it midway
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+
+        await self.flush()
+
+
+click_buffer = ClickBuffer(
+    shards=async_short_url_shards,
+    flush_interval=settings.CLICK_FLUSH_INTERVAL,
+    max_batch_size=settings.CLICK_FLUSH_MAX_BATCH_SIZE,
+    max_backoff=settings.CLICK_FLUSH_MAX_BACKOFF,
+)
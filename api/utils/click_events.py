@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import hmac
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, func, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from api.core.config import settings
+from api.db.database import async_engine
+from api.utils.hyperloglog import HyperLogLog, merge_registers
+from api.utils.logger import logger
+from api.v1.models.clicks import Click
+from api.v1.models.click_rollups import ClickRollup, ROLLUP_GRANULARITIES
+from api.v1.models.visitor_sketches import VisitorSketch, TOTAL_PERIOD
+
+
+def hash_ip(ip_address: str) -> str:
+    """Keyed hash of a client IP, so clicks can be told apart per visitor
+    without storing the address itself"""
+    if not ip_address:
+        return None
+
+    return hmac.new(
+        settings.SECRET_KEY.encode(), ip_address.encode(), hashlib.sha256
+    ).hexdigest()[:32]
+
+
+def truncate_to_bucket(moment: datetime, granularity: str) -> datetime:
+    """Start of the minute, hour or day bucket `moment` falls in"""
+    if granularity == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup(batch: list) -> list:
+    """Aggregate click events into per link minute, hour and day counts"""
+    counts = Counter(
+        (
+            event["short_code"],
+            granularity,
+            truncate_to_bucket(event["clicked_at"], granularity),
+        )
+        for event in batch
+        for granularity in ROLLUP_GRANULARITIES
+    )
+
+    # sorted, so concurrent workers lock the rollup rows in the same order
+    return [
+        {
+            "short_code": short_code,
+            "granularity": granularity,
+            "bucket_start": bucket_start,
+            "clicks": clicks,
+        }
+        for (short_code, granularity, bucket_start), clicks in sorted(counts.items())
+    ]
+
+
+def visitor_sketches(batch: list) -> dict:
+    """HyperLogLog sketches of the visitors in a batch of click events, per
+    link for the whole period and for the day of the click"""
+    sketches = {}
+
+    for event in batch:
+        if not event["ip_hash"]:
+            continue
+
+        day = event["clicked_at"].date().isoformat()
+
+        for period in (TOTAL_PERIOD, day):
+            key = (event["short_code"], period)
+
+            if key not in sketches:
+                sketches[key] = HyperLogLog(precision=settings.HLL_PRECISION)
+
+            sketches[key].add(event["ip_hash"])
+
+    return sketches
+
+
+def merge_sketch_rows(rows: list, sketches: dict) -> dict:
+    """Merged registers of stored sketch rows, by sketch id"""
+    return {
+        row.id: merge_registers(
+            row.registers, sketches[(row.short_code, row.period)].to_bytes()
+        )
+        for row in rows
+    }
+
+
+async def merge_visitor_sketches(conn: AsyncConnection, sketches: dict):
+    """Merge `sketches` into the stored ones, creating missing rows
+
+    Merges run in a thread before the rows are locked. The rows are then
+    locked in a fixed order, so concurrent workers can't deadlock, and
+    only those another worker changed meanwhile are merged again.
+    """
+    if not sketches:
+        return
+
+    table = VisitorSketch.__table__
+    keys = sorted(sketches)
+    empty = bytes(1 << settings.HLL_PRECISION)
+
+    await conn.execute(
+        pg_insert(table)
+        .values(
+            [
+                {"short_code": short_code, "period": period, "registers": empty}
+                for short_code, period in keys
+            ]
+        )
+        .on_conflict_do_nothing(constraint="uq_visitor_sketches_short_code_period")
+    )
+
+    query = (
+        select(table.c.id, table.c.short_code, table.c.period, table.c.registers)
+        .where(tuple_(table.c.short_code, table.c.period).in_(keys))
+        .order_by(table.c.short_code, table.c.period)
+    )
+
+    rows = (await conn.execute(query)).all()
+    merged = await asyncio.to_thread(merge_sketch_rows, rows, sketches)
+    read = {row.id: row.registers for row in rows}
+
+    # the rows stay locked until the transaction ends, so concurrent
+    # workers can't overwrite each other's merges
+    locked = (await conn.execute(query.with_for_update())).all()
+    changed = [row for row in locked if read.get(row.id) != row.registers]
+
+    if changed:
+        merged.update(await asyncio.to_thread(merge_sketch_rows, changed, sketches))
+
+    updates = [
+        {"sketch_id": sketch_id, "merged": registers}
+        for sketch_id, registers in merged.items()
+    ]
+
+    await conn.execute(
+        update(table)
+        .where(table.c.id == bindparam("sketch_id"))
+        .values(registers=bindparam("merged"), updated_at=func.now()),
+        updates,
+    )
+
+
+class ClickEventQueue:
+    """Bounded in-memory queue of click events, drained into the clicks
+    table by a background task with multi-row INSERTs
+
+    Each batch also increments the minute, hour and day `ClickRollup`
+    buckets it falls in and merges its visitors into the per link
+    `VisitorSketch`es, in the same transaction, so stats never have to scan
+    raw clicks.
+
+    Emitting an event never waits on the database. When the queue is full
+    new events are dropped and counted instead, so redirect latency does
+    not depend on how fast analytics can be written.
+
+    Args:
+        engine (AsyncEngine): engine the events are written with
+        maxsize (int): maximum number of events waiting to be written
+        batch_size (int): maximum number of events per INSERT
+        flush_interval (float): seconds between two drains of the queue
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        maxsize: int = 100000,
+        batch_size: int = 1000,
+        flush_interval: float = 1,
+    ):
+        self.engine = engine
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.emitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._events = deque()
+        self._flush_requested = None
+        self._stopping = False
+        self._task = None
+
+    def emit(
+        self,
+        short_code: str,
+        referrer: str = None,
+        user_agent: str = None,
+        ip_address: str = None,
+    ):
+        """Queue a click event, or drop it if the queue is full"""
+        if len(self._events) >= self.maxsize:
+            self.dropped += 1
+            return
+
+        self._events.append(
+            {
+                "short_code": short_code,
+                "clicked_at": datetime.now(timezone.utc),
+                "referrer": referrer,
+                "user_agent": user_agent,
+                "ip_hash": hash_ip(ip_address),
+            }
+        )
+        self.emitted += 1
+
+        if self._flush_requested and len(self._events) >= self.batch_size:
+            self._flush_requested.set()
+
+    def _next_batch(self) -> list:
+        count = min(len(self._events), self.batch_size)
+        return [self._events.popleft() for _ in range(count)]
+
+    async def write(self, batch: list):
+        """Insert a batch of events and add them to the rollups"""
+        rollups = pg_insert(ClickRollup.__table__).values(rollup(batch))
+        rollups = rollups.on_conflict_do_update(
+            constraint="uq_click_rollups_short_code_granularity_bucket_start",
+            set_={
+                "clicks": ClickRollup.__table__.c.clicks + rollups.excluded.clicks,
+                "updated_at": func.now(),
+            },
+        )
+
+        # hashing every visitor is CPU work, kept off the event loop
+        sketches = await asyncio.to_thread(visitor_sketches, batch)
+
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(Click.__table__).values(batch))
+            await conn.execute(rollups)
+            await merge_visitor_sketches(conn, sketches)
+
+    async def flush(self):
+        """Write every queued event"""
+        while self._events:
+            batch = self._next_batch()
+
+            try:
+                await self.write(batch)
+                self.written += len(batch)
+            except Exception as e:
+                # analytics are best effort, a failed batch is counted and lost
+                self.failed += len(batch)
+                logger.exception(f"Failed to write click events; {e}")
+
+    async def run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            self._flush_requested.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background drain task on the running event loop"""
+        if self._task is None:
+            self._flush_requested = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background task and write the events still queued"""
+        if self._task is not None:
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._events),
+            "maxsize": self.maxsize,
+            "emitted": self.emitted,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+
+click_events = ClickEventQueue(
+    engine=async_engine,
+    maxsize=settings.CLICK_EVENTS_QUEUE_SIZE,
+    batch_size=settings.CLICK_EVENTS_BATCH_SIZE,
+    flush_interval=settings.CLICK_EVENTS_FLUSH_INTERVAL,
+)
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import json
+import os
+import time
+
+from api.core.config import settings
+
+
+class SpaceSaving:
+    """Space-Saving top-k summary with exponential time decay
+
+    Tracks at most `capacity` keys. When a new key arrives and the summary
+    is full, it replaces the key with the smallest count and inherits that
+    count, which keeps the heaviest keys in the summary with a bounded
+    over-estimate.
+
+    Decay uses forward weights: a hit at time `t` weighs
+    `2 ** ((t - origin) / half_life)`, so older hits count for less without
+    touching every counter on each tick. Counters are rescaled whenever the
+    weights grow too large.
+
+    Args:
+        capacity (int): maximum number of keys tracked
+        half_life (float): seconds after which a hit counts for half
+    """
+
+    # rescale once weights reach 2 ** MAX_EXPONENT, well within float range
+    MAX_EXPONENT = 64
+
+    def __init__(self, capacity: int = 1000, half_life: float = 3600):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.origin = time.time()
+        self.counts = {}
+        self._heap = []
+
+    def _weight(self, now: float) -> float:
+        exponent = (now - self.origin) / self.half_life
+
+        if exponent > self.MAX_EXPONENT:
+            self._rescale(now)
+            exponent = 0
+
+        return 2.0**exponent
+
+    def _rescale(self, now: float):
+        factor = 2.0 ** -((now - self.origin) / self.half_life)
+        self.origin = now
+        self.counts = {key: count * factor for key, count in self.counts.items()}
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, key: str, now: float = None):
+        """Record one hit on `key`"""
+        weight = self._weight(now or time.time())
+
+        if key in self.counts:
+            self.counts[key] += weight
+            return
+
+        if len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            heapq.heappush(self._heap, (weight, key))
+            return
+
+        # heap entries are only refreshed lazily, so skip stale ones until
+        # the top holds the true minimum
+        while True:
+            count, smallest = self._heap[0]
+            if self.counts[smallest] == count:
+                break
+            heapq.heapreplace(self._heap, (self.counts[smallest], smallest))
+
+        heapq.heappop(self._heap)
+        del self.counts[smallest]
+
+        self.counts[key] = count + weight
+        heapq.heappush(self._heap, (count + weight, key))
+
+    def scores(self, now: float = None) -> dict:
+        """Decayed hit counts of the tracked keys, as of `now`"""
+        factor = 1 / self._weight(now or time.time())
+        return {key: count * factor for key, count in self.counts.items()}
+
+
+class TrendingLinks:
+    """Short codes with the most recent clicks, merged across workers
+
+    Each worker feeds its own `SpaceSaving` summary from the redirect path
+    and periodically writes its decayed scores to
+    `<directory>/<pid>.json`, and once more when it stops. Reads decay every
+    worker's scores to the same moment and add them up. Files not written
+    for STALE_INTERVALS intervals belong to workers that are gone, reads
+    skip and remove them.
+
+    Args:
+        directory (str): directory shared by all the workers
+        capacity (int): number of short codes tracked per worker
+        half_life (float): seconds after which a click counts for half
+        interval (float): seconds between two snapshots
+    """
+
+    # intervals after which a worker's snapshot is left behind
+    STALE_INTERVALS = 3
+
+    def __init__(
+        self,
+        directory: str,
+        capacity: int = 1000,
+        half_life: float = 3600,
+        interval: float = 5,
+    ):
+        self.directory = directory
+        self.half_life = half_life
+        self.interval = interval
+        self.summary = SpaceSaving(capacity=capacity, half_life=half_life)
+        self._task = None
+
+    def add(self, short_code: str):
+        self.summary.add(short_code)
+
+    def write(self, timestamp: float, scores: dict):
+        """Atomically replace this worker's snapshot file"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w") as file:
+            json.dump({"timestamp": timestamp, "scores": scores}, file)
+
+        os.replace(tmp_path, path)
+
+    def _merge_snapshots(self, now: float, totals: dict) -> dict:
+        """Add the scores of every other worker, decayed to `now`, to `totals`"""
+        own_file = f"{os.getpid()}.json"
+        stale_before = now - self.STALE_INTERVALS * self.interval
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            if name == own_file or not name.endswith(".json"):
+                continue
+
+            path = os.path.join(self.directory, name)
+
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                # removed or being replaced by its worker, skip it this time
+                continue
+
+            if snapshot["timestamp"] < stale_before:
+                self._remove_stale(path, stale_before)
+                continue
+
+            factor = 2.0 ** -((now - snapshot["timestamp"]) / self.half_life)
+
+            for short_code, score in snapshot["scores"].items():
+                totals[short_code] = totals.get(short_code, 0) + score * factor
+
+        return totals
+
+    @staticmethod
+    def _remove_stale(path: str, stale_before: float):
+        try:
+            # its worker may have replaced it since it was read
+            if os.path.getmtime(path) < stale_before:
+                os.remove(path)
+        except OSError:
+            pass
+
+    async def top(self, limit: int = 10) -> list:
+        """The `limit` short codes with the highest decayed click counts
+        across all workers, with their scores"""
+        now = time.time()
+        totals = await asyncio.to_thread(
+            self._merge_snapshots, now, self.summary.scores(now)
+        )
+
+        return heapq.nlargest(limit, totals.items(), key=lambda item: item[1])
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.time()
+            await asyncio.to_thread(self.write, now, self.summary.scores(now))
+
+    def start(self):
+        """Start writing snapshots in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background task, writing one last snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        now = time.time()
+        await asyncio.to_thread(self.write, now, self.summary.scores(now))
+
+
+trending_links = TrendingLinks(
+    directory=os.path.join(settings.METRICS_DIR, "trending"),
+    capacity=settings.TRENDING_CAPACITY,
+    half_life=settings.TRENDING_HALF_LIFE,
+    interval=settings.METRICS_FLUSH_INTERVAL,
+)
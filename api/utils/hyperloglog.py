@@ -0,0 +1,97 @@
+import hashlib
+import math
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _high_bits(size: int) -> int:
+    return int.from_bytes(b"\x80" * size, "big")
+
+
+def merge_registers(first: bytes, second: bytes) -> bytes:
+    """Register-wise maximum of two sketches' registers
+
+    The registers are handled as two big integers, so the whole merge is a
+    handful of C level operations instead of a Python loop per register.
+    Registers never exceed 64, so with the high bit of every byte set in
+    `a`, the subtraction `a - b` can't borrow across bytes, and the high
+    bit of each byte of the result tells whether `a >= b` there.
+    """
+    size = len(first)
+    high = _high_bits(size)
+    a = int.from_bytes(first, "big")
+    b = int.from_bytes(second, "big")
+
+    # 0xff in the bytes where a >= b, 0x00 elsewhere
+    mask = ((((a | high) - b) & high) >> 7) * 0xFF
+
+    return ((a & mask) | (b & ~mask)).to_bytes(size, "big")
+
+
+class HyperLogLog:
+    """HyperLogLog sketch estimating the number of distinct values added to it
+
+    Memory is fixed at `2 ** precision` one-byte registers whatever the
+    number of values, with a standard error of about
+    `1.04 / sqrt(2 ** precision)` (1.6% at the default precision of 12).
+    Sketches of the same precision can be merged, which gives the sketch of
+    the union of their values.
+
+    Args:
+        precision (int, optional): number of index bits, between 4 and 16.
+            Defaults to 12.
+        registers (bytes, optional): registers of a serialized sketch
+    """
+
+    def __init__(self, precision: int = 12, registers: bytes = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision should be between 4 and 16")
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers or self.size)
+
+        if len(self.registers) != self.size:
+            raise ValueError("registers do not match the sketch precision")
+
+    @classmethod
+    def from_bytes(cls, registers: bytes) -> "HyperLogLog":
+        """Rebuild a sketch serialized with `to_bytes`"""
+        return cls(precision=len(registers).bit_length() - 1, registers=registers)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    def add(self, value: str):
+        """Add a value to the sketch"""
+        digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rest = hashed & ((1 << remaining_bits) - 1)
+        # position of the leftmost 1 bit in the remaining bits
+        rank = remaining_bits - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """Fold `other` into this sketch"""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of different precisions")
+
+        self.registers = bytearray(merge_registers(self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimated number of distinct values added"""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        harmonic_sum = sum(2.0**-register for register in self.registers)
+        estimate = alpha * self.size**2 / harmonic_sum
+
+        # small range correction
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+
+        return round(estimate)
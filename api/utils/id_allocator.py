@@ -0,0 +1,51 @@
+import threading
+
+from sqlalchemy import Engine, Sequence
+
+from api.db.database import engine
+from api.v1.models.short_urls import short_code_seq, SHORT_CODE_BLOCK_SIZE
+
+
+class BlockAllocator:
+    """Hands out unique integers from blocks reserved on a database sequence
+
+    Each call to `nextval()` on the sequence reserves `block_size` ids for
+    this process, which are then handed out from memory. The database is
+    only hit once per block, and no two processes ever share an id.
+
+    Args:
+        engine (Engine): engine the sequence lives on
+        sequence (Sequence): sequence whose INCREMENT BY is `block_size`
+        block_size (int): number of ids reserved at a time
+    """
+
+    def __init__(self, engine: Engine, sequence: Sequence, block_size: int):
+        self.engine = engine
+        self.sequence = sequence
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        with self.engine.connect() as conn:
+            start = conn.scalar(self.sequence.next_value())
+
+        self._next = start
+        self._end = start + self.block_size
+
+    def allocate(self) -> int:
+        """Returns an id no other call, in any process, has returned"""
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve_block()
+
+            value = self._next
+            self._next += 1
+
+            return value
+
+
+short_code_allocator = BlockAllocator(
+    engine=engine, sequence=short_code_seq, block_size=SHORT_CODE_BLOCK_SIZE
+)
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """Parse a rate such as "30/minute" into (requests, period in seconds)"""
+    count, _, period = rate.partition("/")
+
+    if period not in RATE_PERIODS or not count.isdigit() or int(count) < 1:
+        raise ValueError(f"invalid rate {rate!r}, expected e.g. '30/minute'")
+
+    return int(count), RATE_PERIODS[period]
+
+
+class TokenBucketLimiter:
+    """Thread safe token bucket rate limiter with one bucket per key
+
+    Each bucket holds up to `burst` tokens and refills at `rate` tokens per
+    second, and every allowed request takes one token. A bucket is only two
+    floats updated on access, so checking a key is O(1) and nothing runs in
+    the background.
+
+    At most `maxsize` buckets are kept, the least recently used one is
+    evicted first. A bucket left idle for `burst / rate` seconds is full
+    again, so evicting it loses nothing.
+
+    Args:
+        rate (float): tokens added to a bucket per second
+        burst (int): size of a bucket
+        maxsize (int): maximum number of buckets kept in memory
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key) -> float:
+        """Take a token from the bucket of `key`
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the number of
+                seconds until the bucket has a token again
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens, updated_at = bucket
+                tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+                self._buckets.move_to_end(key)
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                return (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+
+            return 0
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._buckets),
+            "maxsize": self.maxsize,
+            "rate": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,337 @@
+"""Read-only snapshot of every short code's target url and redirect
+policy, in a file shared by all workers through memory mapping
+
+A snapshot file holds a header, the entries sorted by short code and an
+index of the entries' offsets::
+
+    header   magic, entry count, index offset, generated_at, base_generated_at
+    entries  key length (u16), value length (u32), redirect type (u16,
+             0 for deleted links), cache max age (i32, -1 for none), key,
+             value
+    index    offset of each entry (u64), in short code order
+
+Short codes are compared as bytes, so a lookup is a binary search over
+the index reading the mapped pages in place. Every worker maps the same
+file, the kernel keeps a single copy of it in the page cache.
+
+Next to the base file sits at most one delta file, holding the links
+created or updated since the base was exported, and a tombstone entry,
+with an empty target url, for each link deleted since. It is only used
+with the base it was exported against.
+"""
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from api.core.config import settings
+from api.utils.logger import logger
+
+MAGIC = b"KEKSNAP3"
+HEADER = struct.Struct("<8sQQdd")
+ENTRY = struct.Struct("<HIHi")
+OFFSET = struct.Struct("<Q")
+
+# Redirect type of the tombstone entries of deleted links
+DELETED = 0
+
+
+def delta_path(path: str) -> str:
+    """Path of the delta file of the snapshot at `path`"""
+    return f"{path}.delta"
+
+
+def write_snapshot(
+    path: str, rows, generated_at: float, base_generated_at: float = 0
+) -> int:
+    """Write (short_code, target_url, redirect_type, cache_max_age) rows,
+    sorted by short code bytes, to a snapshot file replacing `path`
+    atomically. Rows of deleted links are (short_code, "", DELETED, None).
+    Returns the entry count.
+
+    Args:
+        path (str): snapshot file to write
+        rows (Iterable[tuple[str, str, int, int]]): entries in short code
+            order
+        generated_at (float): time the exported data was read at
+        base_generated_at (float, optional): `generated_at` of the base
+            snapshot, for delta files. Defaults to 0.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    offsets = array("Q")
+    previous = None
+
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0, generated_at, base_generated_at))
+        offset = HEADER.size
+
+        for short_code, target_url, redirect_type, cache_max_age in rows:
+            key = short_code.encode()
+            value = target_url.encode()
+
+            if previous is not None and key <= previous:
+                raise ValueError(f"short codes are not sorted at {short_code!r}")
+            previous = key
+
+            offsets.append(offset)
+            f.write(
+                ENTRY.pack(
+                    len(key),
+                    len(value),
+                    redirect_type,
+                    -1 if cache_max_age is None else cache_max_age,
+                )
+            )
+            f.write(key)
+            f.write(value)
+            offset += ENTRY.size + len(key) + len(value)
+
+        offsets.tofile(f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(offsets), offset, generated_at, base_generated_at))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return len(offsets)
+
+
+class SnapshotFile:
+    """A memory mapped snapshot file
+
+    Args:
+        path (str): snapshot file to map
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, self.index_offset, self.generated_at, self.base_generated_at = (
+            HEADER.unpack_from(self.buffer, 0)
+        )
+
+        if magic != MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{path} is not a redirect snapshot")
+
+    def get(self, short_code: str):
+        """(target_url, redirect_type, cache_max_age) of `short_code`, None
+        if the file doesn't have it. Deleted links have a DELETED redirect
+        type."""
+        key = short_code.encode()
+        buffer = self.buffer
+        low, high = 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            (offset,) = OFFSET.unpack_from(buffer, self.index_offset + middle * OFFSET.size)
+            key_length, value_length, redirect_type, cache_max_age = ENTRY.unpack_from(
+                buffer, offset
+            )
+            start = offset + ENTRY.size
+            candidate = buffer[start : start + key_length]
+
+            if candidate == key:
+                start += key_length
+                return (
+                    buffer[start : start + value_length].decode(),
+                    redirect_type,
+                    None if cache_max_age < 0 else cache_max_age,
+                )
+
+            if candidate < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def close(self):
+        self.buffer.close()
+
+
+class RedirectSnapshot:
+    """Lookups in the snapshot at `path` and its delta file, reloaded in
+    the background when the export tool replaces them
+
+    Keys invalidated through the redirect cache after the newest mapped
+    file was exported are discarded, so their lookups fall back to the
+    database. Each new base or delta forgets the discards it reflects. It is only used from the event loop, so it needs no locking.
+
+    Args:
+        path (str): base snapshot file
+        refresh_interval (float, optional): seconds between two checks for
+            new files. Defaults to 5.
+    """
+
+    # invalidations this close to the export may have missed it
+    DISCARD_OVERLAP = 30
+
+    def __init__(self, path: str, refresh_interval: float = 5):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.base = None
+        self.delta = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._discarded = {}
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.base is not None
+
+    def get(self, short_code: str):
+        """(target_url, redirect_type, cache_max_age) of `short_code`, None
+        if the snapshot doesn't have it or it changed since"""
+        if self.base is None:
+            return None
+
+        if short_code in self._discarded:
+            self.misses += 1
+            return None
+
+        redirect = None
+
+        if self.delta is not None:
+            redirect = self.delta.get(short_code)
+
+        if redirect is None:
+            redirect = self.base.get(short_code)
+        elif redirect[1] == DELETED:
+            redirect = None
+
+        if redirect is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return redirect
+
+    def discard(self, short_code: str):
+        """Stop serving `short_code` from the snapshot, it was changed"""
+        if self.base is not None:
+            self._discarded[short_code] = time.time()
+
+    @staticmethod
+    def _inode(path: str):
+        try:
+            return os.stat(path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _open(self, path: str, current: SnapshotFile):
+        inode = self._inode(path)
+
+        if inode is None:
+            return None
+
+        if current is not None and current.inode == inode:
+            return current
+
+        return SnapshotFile(path)
+
+    def load(self):
+        """Map the base and delta files again if the export tool replaced
+        them, returns whether anything changed"""
+        base = self._open(self.path, self.base)
+
+        if base is None:
+            if self.base is not None:
+                logger.warning(f"Redirect snapshot {self.path} disappeared, keeping the mapped one")
+            return False
+
+        delta = self._open(delta_path(self.path), self.delta)
+
+        # a delta exported against another base would hide its changes
+        if delta is not None and delta.base_generated_at != base.generated_at:
+            if delta is not self.delta:
+                delta.close()
+            delta = None
+
+        if base is self.base and delta is self.delta:
+            return False
+
+        old = [
+            snapshot_file
+            for snapshot_file in (self.base, self.delta)
+            if snapshot_file is not None and snapshot_file not in (base, delta)
+        ]
+        self.base, self.delta = base, delta
+        self.reloads += 1
+
+        # the delta holds every change and deletion up to its export too
+        newest = delta if delta is not None else base
+        exported_at = newest.generated_at - self.DISCARD_OVERLAP
+        self._discarded = {
+            key: discarded_at
+            for key, discarded_at in self._discarded.items()
+            if discarded_at >= exported_at
+        }
+
+        # lookups run on the event loop, none can be using the old maps
+        for snapshot_file in old:
+            snapshot_file.close()
+
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+
+            try:
+                self.load()
+            except Exception as e:
+                logger.exception(f"Failed to reload the redirect snapshot; {e}")
+
+    async def start(self):
+        """Map the snapshot and follow its updates in the background"""
+        if self._task is not None:
+            return
+
+        try:
+            self.load()
+        except Exception as e:
+            logger.exception(f"Failed to load the redirect snapshot; {e}")
+
+        if self.base is None:
+            logger.warning(f"No redirect snapshot at {self.path}, redirects use the database")
+
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "entries": self.base.count if self.base else 0,
+            "delta_entries": self.delta.count if self.delta else 0,
+            "generated_at": self.base.generated_at if self.base else None,
+            "delta_generated_at": self.delta.generated_at if self.delta else None,
+            "discarded": len(self._discarded),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
+
+
+redirect_snapshot = RedirectSnapshot(
+    settings.REDIRECT_SNAPSHOT_PATH,
+    refresh_interval=settings.REDIRECT_SNAPSHOT_REFRESH_INTERVAL,
+)
@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class SharedCache(ABC):
+    """Cache shared by every worker, used as the second tier behind each
+    worker's in-memory cache
+
+    Besides values it keeps an invalidation log, so workers can drop the
+    keys other workers changed from their own memory. Implementations are
+    blocking and are called from threads.
+    """
+
+    @abstractmethod
+    def get(self, key: str):
+        """The value stored under `key`, None if missing or expired"""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: float):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def publish_invalidation(self, key: str):
+        """Append `key` to the invalidation log"""
+        pass
+
+    def publish_invalidations(self, keys: list[str]):
+        """Append `keys` to the invalidation log, in order"""
+        for key in keys:
+            self.publish_invalidation(key)
+
+    @abstractmethod
+    def last_invalidation(self) -> int:
+        """Position of the latest entry of the invalidation log"""
+        pass
+
+    @abstractmethod
+    def invalidations_since(self, position: int) -> list[tuple[int, str]]:
+        """(position, key) entries of the log after `position`, in order"""
+        pass
+
+    @abstractmethod
+    def prune(self, max_age: float):
+        """Drop expired values and log entries older than `max_age` seconds"""
+        pass
+
+
+class MemorySharedCache(SharedCache):
+    """`SharedCache` in the memory of a single process, for tests and
+    single worker setups"""
+
+    def __init__(self):
+        self._values = {}
+        self._log = []
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        entry = self._values.get(key)
+
+        if entry is None or entry[1] < time.time():
+            return None
+
+        return entry[0]
+
+    def set(self, key: str, value, ttl: float):
+        self._values[key] = (value, time.time() + ttl)
+
+    def delete(self, key: str):
+        self._values.pop(key, None)
+
+    def publish_invalidation(self, key: str):
+        with self._lock:
+            self._last_id += 1
+            self._log.append((self._last_id, key, time.time()))
+
+    def last_invalidation(self) -> int:
+        return self._last_id
+
+    def invalidations_since(self, position: int) -> list[tuple[int, str]]:
+        return [(entry_id, key) for entry_id, key, _ in self._log if entry_id > position]
+
+    def prune(self, max_age: float):
+        now = time.time()
+
+        with self._lock:
+            for key, (_, expires_at) in list(self._values.items()):
+                if expires_at < now:
+                    self._values.pop(key, None)
+
+            self._log = [entry for entry in self._log if entry[2] >= now - max_age]
+
+
+class SQLiteSharedCache(SharedCache):
+    """`SharedCache` in a SQLite file, shared by the workers of one host
+
+    A stand-in for a networked cache: values and the invalidation log live
+    in two tables of the same file, with one connection per thread. Values
+    are stored as JSON.
+
+    Args:
+        path (str): path of the database file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS invalidations "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+
+        return connection
+
+    def get(self, key: str):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value, ttl: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl),
+        )
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def publish_invalidation(self, key: str):
+        self._connection().execute(
+            "INSERT INTO invalidations (key, created_at) VALUES (?, ?)",
+            (key, time.time()),
+        )
+
+    def publish_invalidations(self, keys: list[str]):
+        now = time.time()
+        connection = self._connection()
+        # one transaction, not one per key
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT INTO invalidations (key, created_at) VALUES (?, ?)",
+                [(key, now) for key in keys],
+            )
+
+    def last_invalidation(self) -> int:
+        row = self._connection().execute("SELECT MAX(id) FROM invalidations").fetchone()
+        return row[0] or 0
+
+    def invalidations_since(self, position: int) -> list[tuple[int, str]]:
+        return (
+            self._connection()
+            .execute(
+                "SELECT id, key FROM invalidations WHERE id > ? ORDER BY id",
+                (position,),
+            )
+            .fetchall()
+        )
+
+    def prune(self, max_age: float):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        connection.execute(
+            "DELETE FROM invalidations WHERE created_at < ?", (now - max_age,)
+        )
+
+
+def create_shared_cache(kind: str, path: str = None) -> SharedCache:
+    """Shared cache backend named by the REDIRECT_L2_CACHE setting, None
+    for "none"
+
+    Args:
+        kind (str): "none", "memory" or "sqlite"
+        path (str, optional): database file of the "sqlite" backend
+    """
+    if kind == "none":
+        return None
+    if kind == "memory":
+        return MemorySharedCache()
+    if kind == "sqlite":
+        return SQLiteSharedCache(path)
+
+    raise ValueError(f"unknown shared cache backend {kind!r}")
@@ -1,3 +1,7 @@
 from api.v1.models.activity_logs import ActivityLog
 from api.v1.models.user import User
 from api.v1.models.short_urls import ShortUrl
+from api.v1.models.clicks import Click
+from api.v1.models.click_rollups import ClickRollup
+from api.v1.models.visitor_sketches import VisitorSketch
+from api.v1.models.short_url_deletions import ShortUrlDeletion
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, DateTime, BigInteger, UniqueConstraint
+from api.v1.models.base_model import BaseTableModel
+
+# Bucket sizes clicks are rolled up into
+ROLLUP_GRANULARITIES = ("minute", "hour", "day")
+
+
+class ClickRollup(BaseTableModel):
+    __tablename__ = "click_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "short_code",
+            "granularity",
+            "bucket_start",
+            name="uq_click_rollups_short_code_granularity_bucket_start",
+        ),
+    )
+
+    short_code = Column(String, nullable=False)
+    granularity = Column(String, nullable=False)
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    clicks = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, DateTime, Index
+from api.v1.models.base_model import BaseTableModel
+
+
+class Click(BaseTableModel):
+    __tablename__ = "clicks"
+    __table_args__ = (Index("ix_clicks_short_code_clicked_at", "short_code", "clicked_at"),)
+
+    short_code = Column(String, nullable=False)
+    clicked_at = Column(DateTime(timezone=True), nullable=False)
+    referrer = Column(String, nullable=True)
+    user_agent = Column(String, nullable=True)
+    ip_hash = Column(String, nullable=True)
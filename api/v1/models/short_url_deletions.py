@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, Index
+from api.v1.models.base_model import BaseTableModel
+
+
+class ShortUrlDeletion(BaseTableModel):
+    """A deleted short url, `created_at` being when it was deleted. Kept on
+    the primary whatever the sharding, for snapshot deltas and the
+    rebalance tool to find deletions without scanning every short url."""
+
+    __tablename__ = "short_url_deletions"
+    __table_args__ = (
+        Index("ix_short_url_deletions_created_at", "created_at"),
+        Index("ix_short_url_deletions_short_code", "short_code"),
+    )
+
+    short_code = Column(String, nullable=False)
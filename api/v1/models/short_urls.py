@@ -1,15 +1,38 @@
-from sqlalchemy import Column, String, ForeignKey, Integer
+from sqlalchemy import Column, String, ForeignKey, Integer, Index, Sequence
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from api.db.database import Base
 from api.v1.models.base_model import BaseTableModel
 
+# Number of ids handed out by one nextval() call on short_code_seq. Must
+# match the INCREMENT BY of the sequence in the database.
+SHORT_CODE_BLOCK_SIZE = 1000
+
+# Source of the integers generated short codes are encoded from. Each
+# nextval() reserves a block of SHORT_CODE_BLOCK_SIZE ids for one worker.
+short_code_seq = Sequence(
+    "short_code_seq", start=1, increment=SHORT_CODE_BLOCK_SIZE, metadata=Base.metadata
+)
+
 
 class ShortUrl(BaseTableModel):
     __tablename__ = "short_urls"
+    __table_args__ = (
+        Index("ix_short_urls_user_id_created_at_id", "user_id", "created_at", "id"),
+        # lets workers pick up recently created codes without a table scan
+        Index("ix_short_urls_created_at", "created_at"),
+        # lets redirect snapshot deltas find changed links
+        Index("ix_short_urls_updated_at", "updated_at"),
+    )
 
     user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     target_url = Column(String, nullable=False)
-    short_code = Column(String, nullable=False)
+    short_code = Column(String, nullable=False, unique=True, index=True)
     access_count = Column(Integer, nullable=True, default=0)
+    # status code of the redirect, 301, 302 or 307
+    redirect_type = Column(Integer, nullable=False, default=301, server_default="301")
+    # seconds browsers and CDNs may cache the redirect, None for
+    # REDIRECT_DEFAULT_CACHE_MAX_AGE
+    cache_max_age = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="short_urls")
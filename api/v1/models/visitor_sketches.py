@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, LargeBinary, UniqueConstraint
+from api.v1.models.base_model import BaseTableModel
+
+# Period of the sketch covering the whole life of a link. Other sketches
+# cover a single day and use its ISO date as period.
+TOTAL_PERIOD = "total"
+
+
+class VisitorSketch(BaseTableModel):
+    """HyperLogLog sketch of the visitors of a link over a period"""
+
+    __tablename__ = "visitor_sketches"
+    __table_args__ = (
+        UniqueConstraint(
+            "short_code", "period", name="uq_visitor_sketches_short_code_period"
+        ),
+    )
+
+    short_code = Column(String, nullable=False)
+    period = Column(String, nullable=False)
+    registers = Column(LargeBinary, nullable=False)
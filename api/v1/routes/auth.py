@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Depends, status, Request, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
 from authlib.integrations.base_client import OAuthError
 from authlib.oauth2.rfc6749 import OAuth2Token
 
 from api.core import response_messages
-from api.db.database import get_db
+from api.db.database import get_db, get_async_db
 from api.utils import jwt_helpers
 from api.core.dependencies.security import get_current_user
+from api.core.dependencies.rate_limit import auth_rate_limit
 from api.core.config import settings
 from api.v1.schemas import auth as auth_schema
 from api.v1.services import auth as auth_service
@@ -23,21 +25,22 @@ auth = APIRouter(prefix="/auth", tags=["Authentication"])
     summary="Create a new user account",
     description="This endpoint takes in the user creation details and returns jwt tokens along with user data",
     tags=["Authentication"],
+    dependencies=[Depends(auth_rate_limit)],
 )
-def register(
+async def register(
     schema: auth_schema.RegisterRequest,
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_async_db)],
 ):
     """Endpoint for a user to register their account
 
     Args:
     schema (auth_schema.LoginRequest): Login request schema
-    db (Annotated[Session, Depends): Database session
+    db (Annotated[AsyncSession, Depends): Database session
     """
 
     # Create user account
 
-    user = auth_service.register(db=db, schema=schema)
+    user = await auth_service.register_async(db=db, schema=schema)
 
     # Create access and refresh tokens
     access_token = jwt_helpers.create_jwt_token("access", user.id)
@@ -66,19 +69,20 @@ def register(
     summary="Login a registered user",
     description="This endpoint retrieves the jwt tokens for a registered user",
     tags=["Authentication"],
+    dependencies=[Depends(auth_rate_limit)],
 )
-def login(
+async def login(
     schema: auth_schema.LoginRequest,
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_async_db)],
 ):
     """Endpoint for user login
 
     Args:
         schema (auth_schema.LoginRequest): Login request schema
-        db (Annotated[Session, Depends): Database session
+        db (Annotated[AsyncSession, Depends): Database session
     """
 
-    user = auth_service.authenticate(db=db, schema=schema)
+    user = await auth_service.authenticate_async(db=db, schema=schema)
 
     # Create access and refresh tokens
     access_token = jwt_helpers.create_jwt_token("access", user.id)
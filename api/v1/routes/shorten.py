@@ -1,9 +1,21 @@
-from fastapi import APIRouter, Depends, status, Request, HTTPException
+import json
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Query, status, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import Annotated
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal, Optional
 
-from api.db.database import get_db
+from api.core import response_messages
+from api.core.config import settings
+from api.db.database import get_db, get_async_db
 from api.core.dependencies.security import get_current_user
+from api.core.dependencies.rate_limit import (
+    shorten_rate_limit,
+    bulk_shorten_rate_limit,
+)
 from api.v1.services import shorten as url_service
 from api.v1.schemas import shorten as url_schema
 from api.v1.models import User
@@ -17,6 +29,7 @@ shorten = APIRouter(prefix="/shorten", tags=["Shortener"])
     summary="Create short url",
     description="Endpoint to generate a short url",
     status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(shorten_rate_limit)],
 )
 def generate_url(
     db: Annotated[Session, Depends(get_db)],
@@ -44,6 +57,8 @@ def generate_url(
         created_at=short_url.created_at,
         updated_at=short_url.updated_at,
         access_count=short_url.access_count,
+        redirect_type=short_url.redirect_type,
+        cache_max_age=short_url.cache_max_age,
     )
 
     return url_schema.CreateShortUrlResponse(
@@ -53,18 +68,178 @@ def generate_url(
     )
 
 
+async def read_bulk_items(request: Request):
+    """Yields `(index, item)` pairs from a bulk request body, where `item` is
+    either a `CreateShortUrl` or the `ValidationError` it failed with.
+
+    The body is either a JSON array, or NDJSON (one object per line) when
+    sent as `application/x-ndjson`, which is parsed as it streams in.
+    """
+    content_type = request.headers.get("content-type", "")
+
+    def parse(index, value):
+        try:
+            if isinstance(value, (str, bytes)):
+                return index, url_schema.CreateShortUrl.model_validate_json(value)
+            return index, url_schema.CreateShortUrl.model_validate(value)
+        except ValidationError as e:
+            return index, e
+
+    if "ndjson" in content_type:
+        index = 0
+        buffer = b""
+
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+
+            for line in lines:
+                if line.strip():
+                    yield parse(index, line)
+                    index += 1
+
+        if buffer.strip():
+            yield parse(index, buffer)
+        return
+
+    try:
+        body = json.loads(await request.body())
+    except ValueError:
+        body = None
+
+    if not isinstance(body, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.BULK_INVALID_BODY,
+        )
+
+    for index, value in enumerate(body):
+        yield parse(index, value)
+
+
+@shorten.post(
+    path="/bulk",
+    response_model=url_schema.BulkCreateShortUrlResponse,
+    summary="Create short urls in bulk",
+    description="Endpoint to generate many short urls at once. The body is a JSON array of short url requests, or NDJSON with one request per line when sent as application/x-ndjson",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(bulk_shorten_rate_limit)],
+)
+async def bulk_generate_url(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_async_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+) -> url_schema.BulkCreateShortUrlResponse:
+    """Endpoint to generate short urls in bulk
+
+    Args:
+        request (Request): Request carrying the JSON array or NDJSON body
+        db (Annotated[AsyncSession, Depends): Database Session
+        current_user (Annotated[User, Depends): Currently logged in user
+
+    Returns:
+        url_schema.BulkCreateShortUrlResponse: Result for every item
+    """
+    items = []
+    invalid = []
+
+    async for index, item in read_bulk_items(request):
+        if index >= settings.BULK_SHORTEN_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=response_messages.BULK_TOO_MANY_ITEMS,
+            )
+
+        if isinstance(item, ValidationError):
+            invalid.append(
+                url_schema.BulkShortUrlResult(
+                    index=index,
+                    status="invalid",
+                    message="; ".join(error["msg"] for error in item.errors()),
+                )
+            )
+        else:
+            items.append((index, item))
+
+    results = await url_service.bulk_create_short_urls_async(
+        db=db, items=items, current_user=current_user
+    )
+
+    return url_schema.BulkCreateShortUrlResponse(
+        status_code=status.HTTP_200_OK,
+        message="Bulk short urls processed successfully!",
+        data=sorted(results + invalid, key=lambda result: result.index),
+    )
+
+
 @shorten.get(
     path="",
     response_model=url_schema.AllShortUrlsResponse,
+    response_model_exclude_unset=True,
     summary="Retrieve all short url",
-    description="Endpoint to retrieve all short url data for current user",
+    description="Endpoint to retrieve the current user's short urls one page at a time. Pass the returned next_cursor to fetch the following page",
     status_code=status.HTTP_200_OK,
 )
 def retrieve_all_url(
     db: Annotated[Session, Depends(get_db)],
     current_user: Annotated[User, Depends(get_current_user)],
+    limit: Annotated[int, Query(ge=1, le=500)] = 50,
+    cursor: Optional[str] = None,
+    fields: Annotated[
+        Optional[str], Query(description="Comma separated list of fields to return")
+    ] = None,
+    sort: Literal["created_at", "-created_at"] = "-created_at",
 ):
-    return url_service.get_all_short_urls(db=db, current_user=current_user)
+    return url_service.get_all_short_urls(
+        db=db,
+        current_user=current_user,
+        limit=limit,
+        cursor=cursor,
+        fields=fields.split(",") if fields else None,
+        sort=sort,
+    )
+
+
+@shorten.get(
+    path="/trending",
+    response_model=url_schema.TrendingShortUrlsResponse,
+    summary="Retrieve trending short urls",
+    description="Endpoint to retrieve the short urls with the most recent clicks, scored with a time decay",
+    status_code=status.HTTP_200_OK,
+)
+async def retrieve_trending_urls(
+    current_user: Annotated[User, Depends(get_current_user)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+):
+    trending = await url_service.get_trending_short_urls(limit=limit)
+
+    return url_schema.TrendingShortUrlsResponse(
+        status_code=status.HTTP_200_OK,
+        message="Trending short urls retrieved successfully!",
+        data=trending,
+    )
+
+
+@shorten.get(
+    path="/export",
+    response_class=StreamingResponse,
+    summary="Export all short urls",
+    description="Endpoint to download all of the current user's short urls and their click counts as CSV or NDJSON",
+    status_code=status.HTTP_200_OK,
+)
+def export_urls(
+    current_user: Annotated[User, Depends(get_current_user)],
+    format: Literal["csv", "ndjson"] = "csv",
+):
+    media_types = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+    return StreamingResponse(
+        url_service.export_short_urls(user_id=current_user.id, export_format=format),
+        media_type=media_types[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="short_urls.{format}"'
+        },
+    )
 
 
 @shorten.get(
@@ -90,6 +265,11 @@ def retrieve_url(
         created_at=short_url.created_at,
         updated_at=short_url.updated_at,
         access_count=short_url.access_count,
+        redirect_type=short_url.redirect_type,
+        cache_max_age=short_url.cache_max_age,
+        unique_visitors=url_service.get_unique_visitors(
+            db=db, short_url=short_url.short_code
+        ),
     )
 
     return url_schema.UpdateShortUrlResponse(
@@ -99,11 +279,42 @@ def retrieve_url(
     )
 
 
+@shorten.get(
+    path="/{short_url}/stats",
+    response_model=url_schema.ClickStatsResponse,
+    summary="Retrieve short url click stats",
+    description="Endpoint to retrieve the clicks on a short url per minute, hour or day bucket",
+    status_code=status.HTTP_200_OK,
+)
+def retrieve_url_stats(
+    short_url: str,
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    start: Annotated[Optional[datetime], Query(alias="from")] = None,
+    end: Annotated[Optional[datetime], Query(alias="to")] = None,
+    granularity: Literal["minute", "hour", "day"] = "hour",
+):
+    stats = url_service.get_click_stats(
+        db=db,
+        current_user=current_user,
+        short_url=short_url,
+        start=start,
+        end=end,
+        granularity=granularity,
+    )
+
+    return url_schema.ClickStatsResponse(
+        status_code=status.HTTP_200_OK,
+        message="Click stats retrieved successfully!",
+        data=stats,
+    )
+
+
 @shorten.put(
     path="/{short_url}",
     response_model=url_schema.UpdateShortUrlResponse,
     summary="Update the target url",
-    description="Endpoint to change the target url for a given short code",
+    description="Endpoint to change the target url and redirect policy for a given short code",
     status_code=status.HTTP_200_OK,
 )
 def update_url(
@@ -117,6 +328,8 @@ def update_url(
         current_user=current_user,
         short_url=short_url,
         new_target_url=schema.target_url,
+        redirect_type=schema.redirect_type,
+        cache_max_age=schema.cache_max_age,
     )
 
     response_data = url_schema.ShortUrlData(
@@ -126,6 +339,8 @@ def update_url(
         created_at=short_url.created_at,
         updated_at=short_url.updated_at,
         access_count=short_url.access_count,
+        redirect_type=short_url.redirect_type,
+        cache_max_age=short_url.cache_max_age,
     )
 
     return url_schema.UpdateShortUrlResponse(
@@ -1,14 +1,23 @@
-from typing import Optional, List
+from typing import Optional, List, Literal
 
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from api.v1.schemas.base_schema import BaseResponseModel
 
 
+# Status codes a short url may redirect with
+RedirectType = Literal[301, 302, 307]
+
+# Longest cache max age, in seconds, a short url may ask for: one year
+MAX_CACHE_MAX_AGE = 31536000
+
+
 class CreateShortUrl(BaseModel):
     target_url: str
-    length: int = 7
+    length: int = Field(default=7, ge=4, le=16)
     custom_alias: Optional[str] = None
+    redirect_type: RedirectType = 301
+    cache_max_age: Optional[int] = Field(default=None, ge=0, le=MAX_CACHE_MAX_AGE)
 
 
 class ShortUrlData(BaseModel):
@@ -18,10 +27,28 @@ class ShortUrlData(BaseModel):
     created_at: datetime
     updated_at: datetime
     access_count: int
+    redirect_type: int = 301
+    cache_max_age: Optional[int] = None
+    unique_visitors: Optional[int] = None
+
+
+class ShortUrlListItem(BaseModel):
+    """ShortUrlData where every field is optional, so listings can be
+    projected down to the requested fields"""
+
+    id: Optional[str] = None
+    target_url: Optional[str] = None
+    short_code: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    access_count: Optional[int] = None
+    redirect_type: Optional[int] = None
+    cache_max_age: Optional[int] = None
 
 
 class AllShortUrlsResponse(BaseResponseModel):
-    data: List[ShortUrlData]
+    data: List[ShortUrlListItem]
+    next_cursor: Optional[str] = None
 
 
 class CreateShortUrlResponse(BaseResponseModel):
@@ -29,8 +56,51 @@ class CreateShortUrlResponse(BaseResponseModel):
 
 
 class UpdateShortUrl(BaseModel):
+    """The redirect policy fields are only changed when they are given"""
+
     target_url: str
+    redirect_type: Optional[RedirectType] = None
+    cache_max_age: Optional[int] = Field(default=None, ge=0, le=MAX_CACHE_MAX_AGE)
 
 
 class UpdateShortUrlResponse(BaseResponseModel):
     data: ShortUrlData
+
+
+class BulkShortUrlResult(BaseModel):
+    index: int
+    status: Literal["created", "conflict", "invalid"]
+    data: Optional[ShortUrlData] = None
+    message: Optional[str] = None
+
+
+class BulkCreateShortUrlResponse(BaseResponseModel):
+    data: List[BulkShortUrlResult]
+
+
+class ClickStatsBucket(BaseModel):
+    start: datetime
+    clicks: int
+
+
+class ClickStatsData(BaseModel):
+    short_code: str
+    granularity: str
+    start: datetime
+    end: datetime
+    total_clicks: int
+    unique_visitors: int
+    buckets: List[ClickStatsBucket]
+
+
+class ClickStatsResponse(BaseResponseModel):
+    data: ClickStatsData
+
+
+class TrendingShortUrl(BaseModel):
+    short_code: str
+    score: float
+
+
+class TrendingShortUrlsResponse(BaseResponseModel):
+    data: List[TrendingShortUrl]
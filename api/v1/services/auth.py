@@ -1,8 +1,11 @@
 from fastapi import HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.config import Config
 from authlib.integrations.starlette_client import OAuth
 
+from api.db.replicas import use_primary
 from api.utils import password_utils
 from api.core import response_messages
 from api.core.config import settings
@@ -56,6 +59,41 @@ def register(db: Session, schema: auth_schema.RegisterRequest) -> User:
     return user
 
 
+async def register_async(db: AsyncSession, schema: auth_schema.RegisterRequest) -> User:
+    """Async version of `register`, hashing the password on the
+    dedicated password hasher executor
+
+    Args:
+        db (AsyncSession): Database Session
+        schema (auth_schema.RegisterRequest): Registration schema
+
+    Returns:
+        User: User object for the newly created user
+    """
+
+    # credentials are always checked against the primary, a replica may
+    # not have a new user or password yet
+    use_primary(db)
+
+    # check if user with email already exists
+    if await db.scalar(select(User).where(User.email == schema.email)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.EMAIL_ALREADY_EXISTS,
+        )
+
+    # Hash password
+    schema.password = await password_utils.hash_password_async(password=schema.password)
+
+    user = User(**schema.model_dump())
+
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+
+    return user
+
+
 def google_register(db: Session, schema: auth_schema.RegisterRequest) -> User:
     """Create a new user from google login
 
@@ -109,3 +147,35 @@ def authenticate(db: Session, schema: auth_schema.LoginRequest) -> User:
         )
 
     return user
+
+
+async def authenticate_async(db: AsyncSession, schema: auth_schema.LoginRequest) -> User:
+    """Async version of `authenticate`, verifying the password on the
+    dedicated password hasher executor
+
+    Args:
+        db (AsyncSession): Database Session
+        schema (auth_schema.LoginRequest): Login Request schema
+
+    Returns:
+        User: Authenticated user
+    """
+
+    use_primary(db)
+
+    # check if user with the email exists
+    user = await db.scalar(select(User).where(User.email == schema.email))
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.INVALID_EMAIL,
+        )
+
+    if not await password_utils.verify_password_async(schema.password, user.password):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.INVALID_PASSWORD,
+        )
+
+    return user
@@ -1,17 +1,121 @@
+import base64
+import csv
+import hashlib
+import heapq
+import io
+import json
 import string
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from itertools import islice
+from typing import NamedTuple, Optional
 
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from uuid_extensions import uuid7
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.core import response_messages
+from api.core.config import settings
+from api.db.database import (
+    SessionLocal,
+    async_replicas,
+    short_url_shards,
+    async_short_url_shards,
+)
+from api.db.replicas import mark_recent_writer, use_primary
+from api.utils.bloom_filter import short_code_filter
+from api.utils.cache import LRUCache, TwoTierCache
+from api.utils.shared_cache import create_shared_cache
+from api.utils.redirect_snapshot import redirect_snapshot
+from api.utils.cdn import cdn_purges
+from api.utils.hyperloglog import HyperLogLog, merge_registers
+from api.utils.click_buffer import click_buffer
+from api.utils.click_events import click_events
+from api.utils.heavy_hitters import trending_links
+from api.utils.id_allocator import short_code_allocator
 from api.v1.models.short_urls import ShortUrl
+from api.v1.models.short_url_deletions import ShortUrlDeletion
+from api.v1.models.clicks import Click
+from api.v1.models.click_rollups import ClickRollup
+from api.v1.models.visitor_sketches import VisitorSketch, TOTAL_PERIOD
 from api.v1.models.user import User
 from api.v1.schemas import shorten
 
 # Base62 character set
 BASE62 = string.ascii_letters + string.digits
 
+# Number of Feistel rounds used to scramble generated short codes
+SCRAMBLE_ROUNDS = 4
+
+# Number of generated short codes tried before giving up on a create
+MAX_SHORT_CODE_ATTEMPTS = 3
+
+# Rows fetched per round-trip when exporting
+EXPORT_BATCH_SIZE = 1000
+
+# Width of a stats bucket for each rollup granularity
+GRANULARITY_DELTAS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Maximum number of buckets a single stats request may cover
+MAX_STATS_BUCKETS = 10000
+
+# Range of a stats request without a start, for each rollup granularity,
+# all within MAX_STATS_BUCKETS
+DEFAULT_STATS_RANGES = {
+    "minute": timedelta(days=1),
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90),
+}
+
+# Maximum number of days, so of daily visitor sketches merged, a single
+# stats request may cover
+MAX_STATS_DAYS = 366
+
+# Postgres error code raised on unique constraint violations
+UNIQUE_VIOLATION = "23505"
+
+# Runs a listing query on every shard at once
+shard_executor = ThreadPoolExecutor(
+    max_workers=len(short_url_shards.shard_ids()), thread_name_prefix="shard-query"
+)
+
+
+class RedirectTarget(NamedTuple):
+    """Where a short code redirects to and how"""
+
+    target_url: str
+    redirect_type: int
+    # None for REDIRECT_DEFAULT_CACHE_MAX_AGE
+    cache_max_age: Optional[int]
+
+
+# short_code -> RedirectTarget cache for the redirect path, in each
+# worker's memory and in the cache shared by all of them
+redirect_cache = TwoTierCache(
+    local=LRUCache(
+        maxsize=settings.REDIRECT_CACHE_SIZE, ttl=settings.REDIRECT_CACHE_TTL
+    ),
+    shared=create_shared_cache(
+        settings.REDIRECT_L2_CACHE, settings.REDIRECT_L2_CACHE_PATH
+    ),
+    shared_ttl=settings.REDIRECT_L2_CACHE_TTL,
+    poll_interval=settings.CACHE_INVALIDATION_POLL_INTERVAL,
+    on_invalidate=redirect_snapshot.discard,
+    # v2 values are RedirectTarget fields, v1 held just the target url
+    version="v2",
+)
+
 
 def encode_base62(num: int) -> str:
     """Function to encode an integer to a Base62 string
@@ -36,18 +140,93 @@ def encode_base62(num: int) -> str:
     return "".join(reversed(encoded))
 
 
+def _scramble_key() -> bytes | None:
+    """Key of the short code scramble, None for sequential codes"""
+    if settings.SHORT_CODE_SEQUENTIAL:
+        return None
+
+    if settings.SHORT_CODE_SCRAMBLE_KEY:
+        return settings.SHORT_CODE_SCRAMBLE_KEY.encode()
+
+    if settings.ENVIRONMENT != "dev":
+        raise ValueError(
+            "SHORT_CODE_SCRAMBLE_KEY is required outside dev, "
+            "set SHORT_CODE_SEQUENTIAL=true for sequential codes"
+        )
+
+    return hashlib.blake2b(settings.SECRET_KEY.encode(), person=b"short-codes").digest()
+
+
+scramble_key = _scramble_key()
+
+
+def _feistel_round_key(round_number: int, value: int, mask: int) -> int:
+    digest = hashlib.blake2b(
+        f"{round_number}:{value}".encode(),
+        key=scramble_key,
+        digest_size=8,
+    ).digest()
+    return int.from_bytes(digest, "big") & mask
+
+
+def scramble(num: int, space: int) -> int:
+    """Bijectively map `num` onto another integer in `[0, space)`
+
+    A keyed Feistel network permutes the smallest even-bit-width range
+    covering `space`, and cycle walking repeats the permutation until the
+    result falls back inside `space`.
+
+    Args:
+        num (int): integer to scramble, must be lower than `space`
+        space (int): size of the range to permute
+
+    Returns:
+        int: scrambled integer
+    """
+    bits = (space - 1).bit_length()
+    half_bits = (bits + 1) // 2
+    mask = (1 << half_bits) - 1
+
+    while True:
+        left, right = num >> half_bits, num & mask
+
+        for round_number in range(SCRAMBLE_ROUNDS):
+            left, right = right, left ^ _feistel_round_key(round_number, right, mask)
+
+        num = (left << half_bits) | right
+
+        if num < space:
+            return num
+
+
 def generate_short_code(length: int = 7) -> str:
-    """Generate a short code from uuid
+    """Generate a short code from an id reserved on the short code sequence
+
+    Ids are unique across every worker, so generated codes never collide
+    with each other and do not need checking against the database.
 
     Args:
         length (int, optional): length of the short code. Defaults to 7.
+            Longer codes are returned once ids no longer fit in `length`
+            characters.
 
     Returns:
         str: generated short code
     """
-    unique_id = uuid7().int
-    encoded_id = encode_base62(unique_id)
-    return encoded_id[-length:]
+    unique_id = short_code_allocator.allocate()
+
+    while unique_id >= len(BASE62) ** length:
+        length += 1
+
+    if scramble_key is not None:
+        unique_id = scramble(unique_id, len(BASE62) ** length)
+
+    return encode_base62(unique_id).rjust(length, BASE62[0])
+
+
+def is_unique_violation(error: IntegrityError) -> bool:
+    """Checks if an IntegrityError was raised by a unique constraint"""
+    return getattr(error.orig, "pgcode", None) == UNIQUE_VIOLATION
 
 
 def create_shortened_url(
@@ -57,25 +236,174 @@ def create_shortened_url(
     custom_alias = schema.custom_alias
     length = schema.length
 
-    if custom_alias:
-        url_string = custom_alias
-    else:
-        url_string = generate_short_code(length=length)
+    # The unique index on short_code decides whether a code is available,
+    # so there is no SELECT before the INSERT. Generated codes can only
+    # clash with custom aliases or codes issued before the sequence existed,
+    # so they get a few retries, custom aliases fail straight away.
+    attempts = 1 if custom_alias else MAX_SHORT_CODE_ATTEMPTS
+
+    for _ in range(attempts):
+        url_string = custom_alias or generate_short_code(length=length)
+
+        short_url = ShortUrl(
+            target_url=target_url,
+            short_code=url_string,
+            user_id=current_user.id,
+            redirect_type=schema.redirect_type,
+            cache_max_age=schema.cache_max_age,
+        )
 
-    existing_url = db.query(ShortUrl).filter(ShortUrl.short_code == url_string).first()
+        db.add(short_url)
 
-    if existing_url:
-        raise HTTPException(status_code=400, detail=response_messages.ALIAS_IN_USE)
+        try:
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            if not is_unique_violation(e):
+                raise
+            continue
 
-    short_url = ShortUrl(
-        target_url=target_url, short_code=url_string, user_id=current_user.id
-    )
+        db.refresh(short_url)
+
+        short_code_filter.publish([short_url.short_code])
+        mark_recent_writer(current_user.id)
+
+        return short_url
+
+    raise HTTPException(status_code=400, detail=response_messages.ALIAS_IN_USE)
 
-    db.add(short_url)
-    db.commit()
-    db.refresh(short_url)
 
-    return short_url
+async def bulk_create_short_urls_async(
+    db: AsyncSession,
+    items: list[tuple[int, shorten.CreateShortUrl]],
+    current_user: User,
+) -> list[shorten.BulkShortUrlResult]:
+    """Create many short urls in one transaction
+
+    Rows are inserted with multi-row `INSERT ... ON CONFLICT DO NOTHING`
+    statements, so an alias that is already taken only fails its own item
+    instead of the whole batch.
+
+    Args:
+        db (AsyncSession): Database Session
+        items (list[tuple[int, shorten.CreateShortUrl]]): items to create,
+            along with their position in the request
+        current_user (User): Currently logged in user
+
+    Returns:
+        list[shorten.BulkShortUrlResult]: one result per item
+    """
+    results = {}
+    pending = []
+    created_codes = []
+    seen_aliases = set()
+
+    for index, item in items:
+        if item.custom_alias and item.custom_alias in seen_aliases:
+            results[index] = shorten.BulkShortUrlResult(
+                index=index, status="conflict", message=response_messages.ALIAS_IN_USE
+            )
+            continue
+
+        if item.custom_alias:
+            seen_aliases.add(item.custom_alias)
+
+        pending.append((index, item))
+
+    for _ in range(MAX_SHORT_CODE_ATTEMPTS):
+        if not pending:
+            break
+
+        generated = [item for _, item in pending if not item.custom_alias]
+        codes = iter(
+            await run_in_threadpool(
+                lambda: [generate_short_code(length=item.length) for item in generated]
+            )
+        )
+        rows = [
+            (index, item, item.custom_alias or next(codes)) for index, item in pending
+        ]
+        pending = []
+
+        # every shard gets its own INSERTs
+        rows_by_shard = defaultdict(list)
+        for index, item, short_code in rows:
+            shard_id = async_short_url_shards.shard_for(short_code)
+            rows_by_shard[shard_id].append((index, item, short_code))
+
+        batches = [
+            (shard_id, shard_rows[start : start + settings.BULK_SHORTEN_BATCH_SIZE])
+            for shard_id, shard_rows in rows_by_shard.items()
+            for start in range(0, len(shard_rows), settings.BULK_SHORTEN_BATCH_SIZE)
+        ]
+
+        for shard_id, batch in batches:
+            stmt = (
+                insert(ShortUrl)
+                .values(
+                    [
+                        {
+                            "target_url": item.target_url,
+                            "short_code": short_code,
+                            "user_id": current_user.id,
+                            "access_count": 0,
+                            "redirect_type": item.redirect_type,
+                            "cache_max_age": item.cache_max_age,
+                        }
+                        for _, item, short_code in batch
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=[ShortUrl.short_code])
+                .returning(
+                    ShortUrl.id,
+                    ShortUrl.target_url,
+                    ShortUrl.short_code,
+                    ShortUrl.created_at,
+                    ShortUrl.updated_at,
+                    ShortUrl.access_count,
+                    ShortUrl.redirect_type,
+                    ShortUrl.cache_max_age,
+                )
+            )
+
+            created = {
+                row.short_code: row
+                for row in await db.execute(
+                    stmt, bind_arguments={"shard_id": shard_id}
+                )
+            }
+
+            for index, item, short_code in batch:
+                if short_code in created:
+                    created_codes.append(short_code)
+                    results[index] = shorten.BulkShortUrlResult(
+                        index=index,
+                        status="created",
+                        data=shorten.ShortUrlData.model_validate(
+                            created[short_code], from_attributes=True
+                        ),
+                    )
+                elif item.custom_alias:
+                    results[index] = shorten.BulkShortUrlResult(
+                        index=index,
+                        status="conflict",
+                        message=response_messages.ALIAS_IN_USE,
+                    )
+                else:
+                    # generated code clashed, try again with a new one
+                    pending.append((index, item))
+
+    for index, _ in pending:
+        results[index] = shorten.BulkShortUrlResult(
+            index=index, status="conflict", message=response_messages.ALIAS_IN_USE
+        )
+
+    await db.commit()
+
+    await run_in_threadpool(short_code_filter.publish, created_codes)
+    await run_in_threadpool(mark_recent_writer, current_user.id)
+
+    return sorted(results.values(), key=lambda result: result.index)
 
 
 def check_model_existence(db: Session, short_url: str, user: User = None):
@@ -96,38 +424,413 @@ def check_model_existence(db: Session, short_url: str, user: User = None):
     return obj
 
 
+async def check_model_existence_async(
+    db: AsyncSession, short_url: str, user: User = None
+):
+    """Async version of `check_model_existence`"""
+
+    query = select(ShortUrl)
+
+    if user:
+        query = query.where(ShortUrl.user_id == user.id)
+
+    obj = await db.scalar(query.where(ShortUrl.short_code == short_url))
+
+    if not obj:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Invalid short code"
+        )
+
+    return obj
+
+
 def get_short_url(db: Session, short_url: str, current_user: User = None) -> ShortUrl:
     short_url_object = check_model_existence(db, short_url, current_user)
 
     return short_url_object
 
 
-def get_all_short_urls(db: Session, current_user: User):
-    query = db.query(ShortUrl).filter(ShortUrl.user_id == current_user.id).all()
+async def get_redirect_async(db: AsyncSession, short_url: str) -> RedirectTarget:
+    """Resolve a short code to its target url and redirect policy, serving
+    hot links from `redirect_cache` without touching the database"""
+
+    redirect = redirect_cache.get(short_url)
+
+    if redirect is None:
+        # loaded in redirect-only mode, shared by every worker
+        redirect = redirect_snapshot.get(short_url)
+
+    if redirect is None:
+        # most scanner and typo traffic stops here, before any query
+        if not await short_code_filter.might_exist(short_url):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Invalid short code"
+            )
+
+        async def load_redirect():
+            try:
+                short_url_object = await check_model_existence_async(db, short_url)
+            except HTTPException:
+                if not async_replicas.replicas:
+                    raise
+                # the link may be too new to have reached the replica
+                use_primary(db)
+                short_url_object = await check_model_existence_async(db, short_url)
+
+            return RedirectTarget(
+                short_url_object.target_url,
+                short_url_object.redirect_type,
+                short_url_object.cache_max_age,
+            )
+
+        redirect = await redirect_cache.load(short_url, load_redirect)
+
+    # the shared cache hands tuples back as lists
+    return RedirectTarget(*redirect)
+
+
+def redirect_cache_headers(redirect: RedirectTarget) -> dict:
+    """Cache-Control and Expires headers of a redirect response, telling
+    browsers and CDNs how long they may reuse it"""
+    max_age = redirect.cache_max_age
+
+    if max_age is None:
+        max_age = settings.REDIRECT_DEFAULT_CACHE_MAX_AGE
+
+    if max_age <= 0:
+        return {"Cache-Control": "no-store"}
+
+    return {
+        "Cache-Control": f"public, max-age={max_age}",
+        "Expires": formatdate(time.time() + max_age, usegmt=True),
+    }
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    """Encode the keyset of the last row of a page into an opaque cursor"""
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Decode a cursor created by `encode_cursor`"""
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), id
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.INVALID_CURSOR,
+        )
+
+
+def run_on_shard(query, shard_id: str) -> list:
+    """Rows of `query` on a single shard, with a session of its own so
+    shards can be queried from several threads at once"""
+    with SessionLocal() as db:
+        return db.execute(query, bind_arguments={"shard_id": shard_id}).all()
+
+
+def get_all_short_urls(
+    db: Session,
+    current_user: User,
+    limit: int = 50,
+    cursor: str = None,
+    fields: list[str] = None,
+    sort: str = "-created_at",
+):
+    """Fetch one page of the current user's short urls
+
+    Pages are keyed on `(created_at, id)`, which the
+    `(user_id, created_at, id)` index serves in either direction, so every
+    page costs the same no matter how deep into the listing it is.
+
+    Args:
+        db (Session): Database Session
+        current_user (User): Currently logged in user
+        limit (int, optional): page size. Defaults to 50.
+        cursor (str, optional): `next_cursor` of the previous page.
+        fields (list[str], optional): columns to return. Defaults to all.
+        sort (str, optional): `created_at` for oldest first, `-created_at`
+            for newest first. Defaults to "-created_at".
+
+    Returns:
+        shorten.AllShortUrlsResponse: the page, with the cursor of the next one
+    """
+    fields = fields or list(shorten.ShortUrlListItem.model_fields)
+
+    if any(field not in shorten.ShortUrlListItem.model_fields for field in fields):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.INVALID_FIELDS,
+        )
+
+    # the keyset columns are always read, to build the next cursor
+    columns = {field: getattr(ShortUrl, field) for field in fields}
+    columns.update(created_at=ShortUrl.created_at, id=ShortUrl.id)
+
+    keyset = tuple_(ShortUrl.created_at, ShortUrl.id)
+    descending = sort.startswith("-")
+
+    query = select(*columns.values()).where(ShortUrl.user_id == current_user.id)
+
+    if cursor:
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(keyset < position if descending else keyset > position)
+
+    if descending:
+        query = query.order_by(ShortUrl.created_at.desc(), ShortUrl.id.desc())
+    else:
+        query = query.order_by(ShortUrl.created_at.asc(), ShortUrl.id.asc())
+
+    # one extra row tells whether there is a next page
+    query = query.limit(limit + 1)
+
+    if short_url_shards.enabled:
+        rows = list(
+            islice(
+                heapq.merge(
+                    *shard_executor.map(
+                        lambda shard_id: run_on_shard(query, shard_id),
+                        short_url_shards.shard_ids(),
+                    ),
+                    key=lambda row: (row.created_at, row.id),
+                    reverse=descending,
+                ),
+                limit + 1,
+            )
+        )
+    else:
+        rows = db.execute(query).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
 
     all_short_urls = [
-        shorten.ShortUrlData.model_validate(url, from_attributes=True) for url in query
+        shorten.ShortUrlListItem(**{field: getattr(row, field) for field in fields})
+        for row in rows
     ]
 
     return shorten.AllShortUrlsResponse(
         status_code=status.HTTP_200_OK,
         message="All Short urls fetched successfully",
         data=all_short_urls,
+        next_cursor=next_cursor,
+    )
+
+
+# Columns written by `export_short_urls`, in order
+EXPORT_COLUMNS = [
+    "id",
+    "short_code",
+    "target_url",
+    "access_count",
+    "redirect_type",
+    "cache_max_age",
+    "created_at",
+    "updated_at",
+]
+
+
+def export_short_urls(user_id: str, export_format: str = "csv"):
+    """Yield all of a user's short urls as CSV or NDJSON chunks
+
+    Rows are streamed from a server-side cursor `EXPORT_BATCH_SIZE` at a
+    time, so memory use does not depend on how many links the user has.
+    The generator opens its own session since it outlives the request's.
+
+    Args:
+        user_id (str): id of the user whose links are exported
+        export_format (str, optional): `csv` or `ndjson`. Defaults to "csv".
+
+    Yields:
+        str: chunks of the export
+    """
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+
+    query = (
+        select(*(getattr(ShortUrl, column) for column in EXPORT_COLUMNS))
+        .where(ShortUrl.user_id == user_id)
+        .order_by(ShortUrl.created_at, ShortUrl.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    with SessionLocal() as db:
+        # each shard streams its rows in order, merging keeps them sorted
+        merged = heapq.merge(
+            *(
+                db.execute(query, bind_arguments={"shard_id": shard_id})
+                for shard_id in short_url_shards.shard_ids()
+            ),
+            key=lambda row: (row.created_at, row.id),
+        )
+
+        while rows := list(islice(merged, EXPORT_BATCH_SIZE)):
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(
+                    [
+                        *row[:-2],
+                        row.created_at.isoformat(),
+                        row.updated_at.isoformat(),
+                    ]
+                    for row in rows
+                )
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(
+                        {
+                            **row._asdict(),
+                            "created_at": row.created_at.isoformat(),
+                            "updated_at": row.updated_at.isoformat(),
+                        }
+                    )
+                    + "\n"
+                    for row in rows
+                )
+
+
+def get_unique_visitors(db: Session, short_url: str, periods: list[str] = None) -> int:
+    """Approximate number of distinct visitors of a short url
+
+    Args:
+        db (Session): Database Session
+        short_url (str): short code of the link
+        periods (list[str], optional): ISO dates of the days to count
+            visitors over. Defaults to the whole life of the link.
+
+    Returns:
+        int: estimated number of distinct visitors
+    """
+    sketches = db.scalars(
+        select(VisitorSketch.registers).where(
+            VisitorSketch.short_code == short_url,
+            VisitorSketch.period.in_(periods or [TOTAL_PERIOD]),
+        )
+    )
+
+    merged = bytes(1 << settings.HLL_PRECISION)
+
+    for registers in sketches:
+        merged = merge_registers(merged, registers)
+
+    return HyperLogLog.from_bytes(merged).count()
+
+
+def get_click_stats(
+    db: Session,
+    current_user: User,
+    short_url: str,
+    start: datetime = None,
+    end: datetime = None,
+    granularity: str = "hour",
+) -> shorten.ClickStatsData:
+    """Clicks on a short url between `start` and `end`, per time bucket
+
+    Only the pre-aggregated `ClickRollup` rows are read, so the cost depends
+    on the number of buckets in the range, not on the number of clicks.
+
+    Args:
+        db (Session): Database Session
+        current_user (User): Currently logged in user
+        short_url (str): short code of the link
+        start (datetime, optional): start of the range. Defaults to 1, 7
+            or 90 days before `end` for minute, hour or day granularity.
+        end (datetime, optional): end of the range. Defaults to now.
+        granularity (str, optional): `minute`, `hour` or `day`. Defaults to "hour".
+
+    Returns:
+        shorten.ClickStatsData: click counts of the non empty buckets
+    """
+    check_model_existence(db=db, user=current_user, short_url=short_url)
+
+    end = end or datetime.now(timezone.utc)
+    start = start or end - DEFAULT_STATS_RANGES[granularity]
+
+    # naive datetimes are taken to be UTC
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+
+    buckets_in_range = (end - start) / GRANULARITY_DELTAS[granularity]
+
+    if (
+        start >= end
+        or buckets_in_range > MAX_STATS_BUCKETS
+        or (end.date() - start.date()).days >= MAX_STATS_DAYS
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=response_messages.INVALID_STATS_RANGE,
+        )
+
+    rows = db.execute(
+        select(ClickRollup.bucket_start, ClickRollup.clicks)
+        .where(
+            ClickRollup.short_code == short_url,
+            ClickRollup.granularity == granularity,
+            ClickRollup.bucket_start >= start,
+            ClickRollup.bucket_start < end,
+        )
+        .order_by(ClickRollup.bucket_start)
+    ).all()
+
+    buckets = [
+        shorten.ClickStatsBucket(start=row.bucket_start, clicks=row.clicks)
+        for row in rows
+    ]
+
+    # visitor sketches are per day, so unique visitors cover whole days
+    days = [
+        (start + timedelta(days=offset)).date().isoformat()
+        for offset in range((end.date() - start.date()).days + 1)
+    ]
+
+    return shorten.ClickStatsData(
+        short_code=short_url,
+        granularity=granularity,
+        start=start,
+        end=end,
+        total_clicks=sum(bucket.clicks for bucket in buckets),
+        unique_visitors=get_unique_visitors(db=db, short_url=short_url, periods=days),
+        buckets=buckets,
     )
 
 
 def update_target_url(
-    db: Session, current_user: User, short_url: str, new_target_url: str
+    db: Session,
+    current_user: User,
+    short_url: str,
+    new_target_url: str,
+    redirect_type: int = None,
+    cache_max_age: int = None,
 ) -> ShortUrl:
+    """Change the target url of a short url, and its redirect policy when
+    `redirect_type` or `cache_max_age` are given"""
     short_url_object = check_model_existence(
         db=db, user=current_user, short_url=short_url
     )
 
     short_url_object.target_url = new_target_url
+    if redirect_type is not None:
+        short_url_object.redirect_type = redirect_type
+    if cache_max_age is not None:
+        short_url_object.cache_max_age = cache_max_age
 
     db.commit()
     db.refresh(short_url_object)
 
+    redirect_cache.invalidate(short_url)
+    cdn_purges.purge_short_codes([short_url])
+    mark_recent_writer(current_user.id)
+
     return short_url_object
 
 
@@ -137,8 +840,23 @@ def delete_short_url(db: Session, current_user: User, short_url: str):
     )
 
     db.delete(short_url_object)
+    # lets snapshot deltas drop the link without scanning every short url
+    db.add(ShortUrlDeletion(short_code=short_url))
+
+    # analytics are keyed by short code, an alias claimed again later must
+    # not inherit them. Clicks still buffered by the workers may land after
+    # this, within CLICK_EVENTS_FLUSH_INTERVAL.
+    for model in (Click, ClickRollup, VisitorSketch):
+        db.execute(delete(model).where(model.short_code == short_url))
+
     db.commit()
 
+    # the code stays in short_code_filter until its next rebuild, which
+    # only costs a database lookup on redirects to it meanwhile
+    redirect_cache.invalidate(short_url)
+    cdn_purges.purge_short_codes([short_url])
+    mark_recent_writer(current_user.id)
+
 
 def increment_access_count(db: Session, short_url: str):
     short_url_object = check_model_existence(db=db, short_url=short_url)
@@ -147,3 +865,34 @@ def increment_access_count(db: Session, short_url: str):
 
     db.commit()
     db.refresh(short_url_object)
+
+
+def record_click(
+    short_url: str,
+    referrer: str = None,
+    user_agent: str = None,
+    ip_address: str = None,
+):
+    """Count a click on `short_url` and queue its click event. Both are
+    buffered in memory and written in batches by background tasks, so this
+    never touches the database"""
+
+    click_buffer.add(short_url)
+    trending_links.add(short_url)
+    click_events.emit(
+        short_code=short_url,
+        referrer=referrer,
+        user_agent=user_agent,
+        ip_address=ip_address,
+    )
+
+
+async def get_trending_short_urls(limit: int = 10) -> list[shorten.TrendingShortUrl]:
+    """Short urls with the most recent clicks across all workers. Scores are
+    click counts where a click loses half its weight every
+    `TRENDING_HALF_LIFE` seconds"""
+
+    return [
+        shorten.TrendingShortUrl(short_code=short_code, score=score)
+        for short_code, score in await trending_links.top(limit=limit)
+    ]
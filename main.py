@@ -1,58 +1,227 @@
+import asyncio
 import uvicorn
-from collections import defaultdict
 from typing import Annotated
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, status, HTTPException, Request, Depends
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from starlette.middleware.sessions import SessionMiddleware  # required by google oauth
-from starlette.middleware.base import BaseHTTPMiddleware
 
 from api.core.config import settings
+from api.core.admission import AdmissionControlMiddleware, admission_controller
+from api.core.metrics import (
+    RequestMetricsMiddleware,
+    request_metrics,
+    metrics_store,
+    collect_request_metrics,
+)
 from api.utils.logger import logger
 from api.v1.routes.main import main_router
 from api.v1.services import shorten
-from api.db.database import get_db
+from api.db.database import (
+    get_async_db,
+    engine,
+    async_engine,
+    replica_engines,
+    async_replica_engines,
+    shard_engines,
+    async_shard_engines,
+    replicas,
+    replica_monitor,
+    pool_stats,
+    ping_db,
+    warm_up_pools,
+)
+from api.utils.click_buffer import click_buffer
+from api.utils.click_events import click_events
+from api.utils.heavy_hitters import trending_links
+from api.utils.bloom_filter import short_code_filter
+from api.utils.redirect_snapshot import redirect_snapshot
+from api.utils.cdn import cdn_purges
+from api.core.dependencies.security import user_cache, user_invalidations
+from api.core.dependencies.rate_limit import client_ip, redirect_rate_limit, rate_limits
+from api.utils.password_utils import password_hasher
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if settings.DB_POOL_WARMUP:
+        await warm_up_pools(settings.DB_POOL_WARMUP)
+    replica_monitor.start()
+    await shorten.redirect_cache.start()
+    if settings.REDIRECT_ONLY_MODE:
+        await redirect_snapshot.start()
+    click_buffer.start()
+    click_events.start()
+    metrics_store.start(request_metrics)
+    trending_links.start()
+    await user_invalidations.start()
+    if settings.BLOOM_FILTER_ENABLED:
+        await short_code_filter.start()
     yield
+    await short_code_filter.stop()
+    await user_invalidations.stop()
+    await shorten.redirect_cache.stop()
+    await redirect_snapshot.stop()
+    await trending_links.stop()
+    await metrics_store.stop(request_metrics)
+    await click_events.stop()
+    await click_buffer.stop()
+    await replica_monitor.stop()
+    password_hasher.shutdown()
+    # sends the delayed purges, off the event loop
+    await asyncio.to_thread(cdn_purges.shutdown)
+    await async_engine.dispose()
+    for extra_engine in async_replica_engines + async_shard_engines:
+        await extra_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan, title="Kekere URL Shortener")
 
-# In-memory request counter by endpoint and IP address
-request_counter = defaultdict(lambda: defaultdict(int))
+# Metrics wrap admission control, so shed requests are counted too
+app.add_middleware(AdmissionControlMiddleware, controller=admission_controller)
+app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
+# Redirect-only workers leave the API to the rest of the fleet
+if not settings.REDIRECT_ONLY_MODE:
+    app.include_router(main_router)
 
 
-# Middleware to track request counts and IP addresses
-class RequestCountMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        endpoint = request.url.path
-        ip_address = request.client.host
-        request_counter[endpoint][ip_address] += 1
-        response = await call_next(request)
-        return response
+# Endpoint to get request stats
+@app.get("/request-stats", response_class=JSONResponse)
+async def get_request_stats():
+    metrics = await collect_request_metrics()
 
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "request_counts": metrics.summary(),
+            "message": "endpoints request retreived successfully",
+        },
+    )
 
-app.add_middleware(RequestCountMiddleware)
-app.include_router(main_router)
 
+# Endpoint to scrape request metrics in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    metrics = await collect_request_metrics()
 
-# Endpoint to get request stats
-@app.get("/request-stats", response_class=JSONResponse)
-async def get_request_stats():
+    return PlainTextResponse(
+        metrics.prometheus() + admission_controller.prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+# Endpoint to check the database and this worker's connection pools
+@app.get("/health/db", response_class=JSONResponse)
+async def get_db_health():
+    pools = {
+        "sync": pool_stats(engine.pool),
+        "async": pool_stats(async_engine.pool),
+    }
+    for name, sync_engines, async_engines in (
+        ("replica", replica_engines, async_replica_engines),
+        ("shard", shard_engines, async_shard_engines),
+    ):
+        for index, (sync_pool_engine, async_pool_engine) in enumerate(
+            zip(sync_engines, async_engines)
+        ):
+            pools[f"{name}_{index}"] = pool_stats(sync_pool_engine.pool)
+            pools[f"{name}_{index}_async"] = pool_stats(async_pool_engine.pool)
+
+    try:
+        latency = await asyncio.wait_for(ping_db(), timeout=settings.DB_POOL_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Database health check failed; {e}")
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={
+                "status": False,
+                "status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "pools": pools,
+                "message": "database is unreachable",
+            },
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "ping_seconds": latency,
+            "pools": pools,
+            "replicas": replicas.stats(),
+            "message": "database health retreived successfully",
+        },
+    )
+
+
+# Endpoint to get this worker's admission control gauges
+@app.get("/admission-stats", response_class=JSONResponse)
+async def get_admission_stats():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "admission": admission_controller.stats(),
+            "message": "admission stats retreived successfully",
+        },
+    )
+
+
+# Endpoint to get cache stats
+@app.get("/cache-stats", response_class=JSONResponse)
+async def get_cache_stats():
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={
-            "request_counts": {
-                endpoint: dict(ips) for endpoint, ips in request_counter.items()
+            "redirect_cache": shorten.redirect_cache.stats(),
+            "user_cache": {
+                **user_cache.stats(),
+                "invalidations": user_invalidations.stats(),
             },
-            "message": "endpoints request retreived successfully",
+            "short_code_filter": short_code_filter.stats(),
+            "redirect_snapshot": redirect_snapshot.stats(),
+            "cdn_purges": cdn_purges.stats(),
+            "message": "cache stats retreived successfully",
+        },
+    )
+
+
+# Endpoint to get click pipeline stats
+@app.get("/click-stats", response_class=JSONResponse)
+async def get_click_stats():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "click_buffer": {"pending": click_buffer.pending()},
+            "click_events": click_events.stats(),
+            "message": "click stats retreived successfully",
+        },
+    )
+
+
+# Endpoint to get password hashing executor stats
+@app.get("/password-hash-stats", response_class=JSONResponse)
+async def get_password_hash_stats():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "password_hasher": password_hasher.stats(),
+            "message": "password hashing stats retreived successfully",
+        },
+    )
+
+
+# Endpoint to get rate limiter stats
+@app.get("/rate-limit-stats", response_class=JSONResponse)
+async def get_rate_limit_stats():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "rate_limits": {
+                name: rate_limit.limiter.stats() for name, rate_limit in rate_limits.items()
+            },
+            "message": "rate limit stats retreived successfully",
         },
     )
 
@@ -83,12 +252,25 @@ async def probe():
 @app.get(
     path="/{short_code}",
     response_class=RedirectResponse,
-    status_code=status.HTTP_301_MOVED_PERMANENTLY,
+    dependencies=[Depends(redirect_rate_limit)],
 )
-async def redirect_to_target(short_code: str, db: Annotated[Session, Depends(get_db)]):
-    target = shorten.get_short_url(db=db, short_url=short_code)
-    shorten.increment_access_count(db=db, short_url=short_code)
-    return target.target_url
+async def redirect_to_target(
+    short_code: str,
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_async_db)],
+):
+    redirect = await shorten.get_redirect_async(db=db, short_url=short_code)
+    shorten.record_click(
+        short_url=short_code,
+        referrer=request.headers.get("referer"),
+        user_agent=request.headers.get("user-agent"),
+        ip_address=client_ip(request),
+    )
+    return RedirectResponse(
+        redirect.target_url,
+        status_code=redirect.redirect_type,
+        headers=shorten.redirect_cache_headers(redirect),
+    )
 
 
 # REGISTER EXCEPTION HANDLERS
@@ -103,6 +285,7 @@ async def http_exception(request: Request, exc: HTTPException):
             "status_code": exc.status_code,
             "message": exc.detail,
         },
+        headers=getattr(exc, "headers", None),
     )
 
 